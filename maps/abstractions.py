@@ -1,5 +1,9 @@
 """Data Abstractions"""
 
+from array import array
+from sys import intern
+
+from features import invalidate_features
 from utils import mean
 
 # Reviews
@@ -46,29 +50,153 @@ def user_rating(user, restaurant_name):
     """Return the rating given for RESTAURANT_NAME by USER."""
     return review_rating(user_reviews(user)[restaurant_name])
 
+def add_user_review(user, review):
+    """Record REVIEW by USER, replacing any earlier review by USER of the same
+    restaurant."""
+    user_reviews(user)[review_restaurant_name(review)] = review
+
 # Restaurants
 
+# Restaurants are stored column-wise: each catalog of restaurants has a store
+# of parallel columns, and a restaurant is a pair of its store and its index in
+# the columns. Names and categories are interned. Prices are kept as given, so
+# a missing price is still None. The reviews of a restaurant are kept with its
+# ratings, so that a review can be replaced by identity; the i-th rating is the
+# rating of the i-th review. The position of each review is found through a
+# dictionary from the ids of the reviews of a restaurant to their positions,
+# made the first time that one of its reviews is replaced. The total of each
+# restaurant's ratings is kept as a running sum, so that it is available
+# without summing the ratings.
+
+class RestaurantStore:
+    """The columns of one catalog of restaurants."""
+    __slots__ = ('names', 'lats', 'lons', 'prices', 'categories', 'ratings',
+                 'reviews', 'positions', 'totals')
+
+    def __init__(self):
+        self.names, self.prices, self.categories = [], [], []
+        self.lats, self.lons = array('d'), array('d')
+        self.ratings, self.reviews, self.totals = [], [], array('d')
+        self.positions = []
+
+_store = RestaurantStore()
+
+def new_catalog():
+    """Keep the restaurants made from now on in a new store. Restaurants made
+    before stay valid, and their store is freed once none of them are used.
+    The cached features of every restaurant are forgotten, so that the cache
+    does not keep the old restaurants alive.
+
+    >>> soda = make_restaurant('Soda', [127.0, 0.1], ['Cafes'], None, [])
+    >>> new_catalog()
+    >>> cafe = make_restaurant('Cafe 3', [0, 0], [], 2, [])
+    >>> restaurant_name(soda), restaurant_price(soda), restaurant_price(cafe)
+    ('Soda', None, 2)
+    """
+    global _store
+    _store = RestaurantStore()
+    invalidate_features()
+
 def make_restaurant(name, location, categories, price, reviews):
-    """Return a restaurant, implemented as a dictionary."""
-    # You may change this starter implementation however you wish, including
-    # adding more items to the dictionary below.
-    return {'name': name, 'location':location, 'categories': categories, 'price': price, 'reviews': reviews}
+    """Return a restaurant, implemented as its store and its index in the
+    columns of the store.
+
+    >>> soda = make_restaurant('Soda', [127.0, 0.1], ['Cafes'], 1,
+    ...                        [make_review('Soda', 4.5), make_review('Soda', 4)])
+    >>> restaurant_name(soda), restaurant_location(soda), restaurant_price(soda)
+    ('Soda', [127.0, 0.1], 1)
+    >>> restaurant_ratings(soda), restaurant_rating_total(soda)
+    ([4.5, 4], 8.5)
+    """
+    # Convert every field before appending so that a bad argument cannot leave
+    # the columns with different lengths.
+    lat, lon = float(location[0]), float(location[1])
+    categories = [intern(c) for c in categories]
+    reviews = list(reviews)
+    ratings = [review_rating(x) for x in reviews]
+    total = float(sum(ratings))
+
+    store = _store
+    index = len(store.names)
+    store.names.append(intern(name))
+    store.lats.append(lat)
+    store.lons.append(lon)
+    store.prices.append(price)
+    store.categories.append(categories)
+    store.ratings.append(ratings)
+    store.reviews.append(reviews)
+    store.positions.append(None)
+    store.totals.append(total)
+    return (store, index)
 
 def restaurant_name(restaurant):
-    return restaurant['name']
+    store, i = restaurant
+    return store.names[i]
 
 def restaurant_location(restaurant):
-    return restaurant['location']
+    store, i = restaurant
+    return [store.lats[i], store.lons[i]]
 
 def restaurant_categories(restaurant):
-    return restaurant['categories']
+    store, i = restaurant
+    return store.categories[i]
 
 def restaurant_price(restaurant):
-    return restaurant['price']
+    store, i = restaurant
+    return store.prices[i]
 
 def restaurant_ratings(restaurant):
     """Return a list of ratings (numbers from 1 to 5)."""
-    return [review_rating(x) for x in restaurant['reviews']]
+    store, i = restaurant
+    return store.ratings[i]
+
+def restaurant_rating_total(restaurant):
+    """Return the sum of the ratings of RESTAURANT, without summing them."""
+    store, i = restaurant
+    return store.totals[i]
+
+def add_restaurant_review(restaurant, review, replaces=None):
+    """Add REVIEW to the reviews of RESTAURANT. If REPLACES is one of its
+    reviews (that very review, not just an equal one), REVIEW takes its place.
+    Return whether a review was replaced. This takes constant time, except
+    that the first replacement at a restaurant indexes its reviews.
+
+    >>> first, second = make_review('Soda', 4), make_review('Soda', 4)
+    >>> soda = make_restaurant('Soda', [0, 0], [], 1, [first])
+    >>> two = make_review('Soda', 2)
+    >>> add_restaurant_review(soda, two, second)
+    False
+    >>> add_restaurant_review(soda, make_review('Soda', 5), first)
+    True
+    >>> restaurant_ratings(soda), restaurant_rating_total(soda)
+    ([5, 2], 7.0)
+    >>> add_restaurant_review(soda, make_review('Soda', 3), two)
+    True
+    >>> restaurant_ratings(soda), restaurant_rating_total(soda)
+    ([5, 3], 8.0)
+    """
+    store, index = restaurant
+    reviews, ratings = store.reviews[index], store.ratings[index]
+    positions = store.positions[index]
+    rating = review_rating(review)
+    if replaces is not None:
+        if positions is None:
+            positions = {id(r): i for i, r in enumerate(reviews)}
+            store.positions[index] = positions
+        # The reviews keep every indexed review alive, so an id found in
+        # POSITIONS cannot belong to another object
+        i = positions.pop(id(replaces), None)
+        if i is not None:
+            store.totals[index] += rating - ratings[i]
+            reviews[i], ratings[i] = review, rating
+            positions[id(review)] = i
+            return True
+    if positions is not None:
+        positions[id(review)] = len(reviews)
+    store.totals[index] += rating
+    reviews.append(review)
+    ratings.append(rating)
+    return False
 
 ### === +++ RESTAURANT ABSTRACTION BARRIER +++ === ###
 
@@ -77,6 +205,8 @@ def restaurant_num_ratings(restaurant):
     return len(restaurant_ratings(restaurant))
 
 def restaurant_mean_rating(restaurant):
-    """Return the average rating for RESTAURANT."""
+    """Return the average rating for RESTAURANT. It is computed from
+    restaurant_ratings, as the abstraction barrier requires; callers that need
+    it often get it through the feature cache or restaurant_rating_total."""
     return sum(restaurant_ratings(restaurant))/restaurant_num_ratings(restaurant)
 
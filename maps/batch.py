@@ -0,0 +1,84 @@
+"""Predicted ratings of every restaurant by every user, for batch jobs"""
+
+import csv
+import json
+from functools import partial
+from multiprocessing import Pool
+
+from abstractions import *
+from recommend import rate_all, feature_set, PREDICTORS
+from data import USERS, RESTAURANTS
+from ucb import main
+
+def rate_user(user, model='best'):
+    """Return a list of the ratings of every restaurant in RESTAURANTS by USER,
+    in the order of RESTAURANTS. Restaurants that USER has not reviewed are
+    rated by the user's predictor for MODEL, a key of PREDICTORS. If USER has
+    too few reviews to fit a predictor, those ratings are None.
+    """
+    reviewed = user_reviewed_restaurants(user, RESTAURANTS)
+    ratings = {name: user_rating(user, name) for name in reviewed}
+    if reviewed:
+        try:
+            ratings = rate_all(user, RESTAURANTS, feature_set(),
+                               PREDICTORS[model])
+        except ZeroDivisionError:
+            pass # Every rating or every feature value of the user is equal
+    return [ratings.get(name) for name in RESTAURANTS]
+
+def rate_all_users(users, processes=None, chunksize=64, model='best'):
+    """Yield [user, ratings] for each of USERS, where ratings is the list
+    returned by rate_user for MODEL. Predictors are fit in a pool of PROCESSES
+    worker processes (default: one per CPU), and results are yielded in order.
+    """
+    users = list(users)
+    rate = partial(rate_user, model=model)
+    if processes == 1:
+        for user in users:
+            yield [user, rate(user)]
+        return
+    with Pool(processes) as pool:
+        for user, row in zip(users, pool.imap(rate, users, chunksize)):
+            yield [user, row]
+
+def write_dense(rows, f):
+    """Write ROWS of [user, ratings] to file F as CSV, with one column per
+    restaurant. Missing ratings are left empty."""
+    writer = csv.writer(f)
+    writer.writerow(['user'] + list(RESTAURANTS))
+    for user, row in rows:
+        writer.writerow([user_name(user)] +
+                        ['' if rating is None else rating for rating in row])
+
+def write_sparse(rows, f):
+    """Write ROWS of [user, ratings] to file F as newline-delimited JSON, with
+    one object per user that lists only the ratings that exist."""
+    names = list(RESTAURANTS)
+    for user, row in rows:
+        ratings = {names[i]: rating for i, rating in enumerate(row)
+                   if rating is not None}
+        f.write(json.dumps({'user': user_name(user), 'ratings': ratings}))
+        f.write('\n')
+
+@main
+def run(*args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Predict ratings of all restaurants by all users')
+    parser.add_argument('-o', '--output', required=True,
+                        help='file to write the rating matrix to')
+    parser.add_argument('-s', '--sparse', action='store_true',
+                        help='write JSON lines with only existing ratings, '
+                        'instead of a dense CSV matrix')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: all CPUs)')
+    parser.add_argument('-p', '--predict', default='best', choices=PREDICTORS,
+                        metavar='MODEL',
+                        help='predictor to use for unreviewed restaurants '
+                        '{{{}}} (default: best)'.format(','.join(PREDICTORS)))
+    args = parser.parse_args()
+
+    rows = rate_all_users(USERS, args.processes, model=args.predict)
+    write = write_sparse if args.sparse else write_dense
+    with open(args.output, 'w', newline='') as f:
+        write(rows, f)
@@ -0,0 +1,227 @@
+"""Synthetic data and scaling benchmarks for the recommendation program
+
+A synthetic catalog has the same format as the Yelp data in data/, with
+restaurants spread over the area shown on the map and users whose ratings
+depend on price, so that predictors can be fit. Each benchmark is timed on
+catalogs of growing size, and the growth in time between sizes is reported as
+an exponent: about 1 for linear time and about 2 for quadratic time.
+"""
+
+import json
+import os
+import tempfile
+import time
+from math import log
+from random import Random
+
+import data
+import recommend
+from abstractions import *
+from recommend import search, best_predictor, rate_all, k_means, feature_set
+from recommend import group_by_first, dbscan
+from visualize import write_map, LONGITUDES, LATITUDES
+from ucb import main
+
+CATEGORIES = ['Restaurants', 'Food', 'Pizza', 'Thai', 'Chinese', 'Mexican',
+              'Sandwiches', 'Cafes', 'Coffee & Tea', 'Bars', 'Burgers',
+              'Japanese', 'Sushi Bars', 'Indian', 'Korean', 'Vietnamese',
+              'Italian', 'Bakeries', 'Desserts', 'Vegetarian']
+
+# Synthetic catalogs
+
+def catalog_records(n_restaurants, n_users, reviews_per_user=10, seed=0):
+    """Return lists of user, review and restaurant records, like those in the
+    datasets in data/, for N_RESTAURANTS restaurants and N_USERS users who
+    each review REVIEWS_PER_USER restaurants."""
+    random = Random(seed)
+    (west, east), (north, south) = LONGITUDES, LATITUDES
+    restaurants = []
+    for i in range(n_restaurants):
+        categories = random.sample(CATEGORIES[1:], random.randint(1, 3))
+        restaurants.append({
+            'business_id': 'b{}'.format(i),
+            'name': 'Restaurant {}'.format(i),
+            'latitude': random.uniform(south, north),
+            'longitude': random.uniform(west, east),
+            'categories': categories + ['Restaurants'],
+            'price': random.randint(1, 4),
+        })
+    users, reviews = [], []
+    for i in range(n_users):
+        user_id = 'u{}'.format(i)
+        users.append({'user_id': user_id, 'name': 'User {}'.format(i)})
+        # Each user likes either cheap or expensive restaurants
+        slope = random.choice([-1, 1])
+        # User i reviews restaurant i, so that every restaurant has a rating
+        # when there are at least as many users as restaurants
+        count = min(reviews_per_user, n_restaurants)
+        chosen = [restaurants[i % n_restaurants]]
+        chosen += random.sample(restaurants, count)
+        chosen = list({r['business_id']: r for r in chosen}.values())[:count]
+        for restaurant in chosen:
+            stars = 3 + slope * (restaurant['price'] - 2.5) + random.gauss(0, 1)
+            reviews.append({'user_id': user_id,
+                            'business_id': restaurant['business_id'],
+                            'stars': min(5, max(1, round(stars)))})
+    return users, reviews, restaurants
+
+def write_catalog(directory, records):
+    """Write user, review and restaurant RECORDS to the datasets users.json,
+    reviews.json and restaurants.json in DIRECTORY."""
+    datasets = ['users.json', 'reviews.json', 'restaurants.json']
+    for dataset, dataset_records in zip(datasets, records):
+        with open(os.path.join(directory, dataset), 'w') as f:
+            for record in dataset_records:
+                f.write(json.dumps(record))
+                f.write('\n')
+
+def load_catalog(directory):
+    """Return the users, reviews and restaurants of the datasets in DIRECTORY,
+    loaded with data.load_data into a store of their own, so that loading
+    them leaves the restaurants of every other catalog valid."""
+    new_catalog()
+    saved = data.DATA_DIRECTORY, data.SNAPSHOT
+    data.DATA_DIRECTORY = directory
+    data.SNAPSHOT = os.path.join(directory, '.snapshot.marshal')
+    try:
+        return data.load_data('users.json', 'reviews.json', 'restaurants.json')
+    finally:
+        data.DATA_DIRECTORY, data.SNAPSHOT = saved
+
+# Benchmarks
+
+def timed(fn, *args):
+    """Return [seconds, result] for calling FN on ARGS."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return [time.perf_counter() - start, result]
+
+def run_benchmarks(n, names, seed=0):
+    """Return a dictionary from each of NAMES to the seconds taken by that
+    benchmark on a catalog of N restaurants and N users. The catalog is
+    written to a temporary directory, which is removed afterwards, and its
+    store of restaurants is freed, even if a benchmark fails."""
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            return time_benchmarks(directory, n, names, seed)
+        finally:
+            new_catalog()
+
+def time_benchmarks(directory, n, names, seed):
+    """Return the times of run_benchmarks, using DIRECTORY for the catalog."""
+    write_catalog(directory, catalog_records(n, n, seed=seed))
+    seconds, (users, _, restaurants) = timed(load_catalog, directory)
+    times = {'load_data': seconds}
+
+    restaurant_list = list(restaurants.values())
+    user = users[0]
+    features = feature_set()
+    ratings = {name: restaurant_mean_rating(r) if restaurant_ratings(r) else 3
+               for name, r in restaurants.items()}
+    centroids = [restaurant_location(r) for r in restaurant_list[:10]]
+    path = os.path.join(directory, 'voronoi.json')
+    # group_by_first with one key per ten pairs, as when clustering into many
+    # clusters
+    pairs = [[i // 10, i] for i in range(n)]
+
+    benchmarks = {
+        'search': lambda: search('Pizza AND NOT Bars', restaurant_list),
+        'best_predictor': lambda: best_predictor(user, restaurants, features),
+        'rate_all': lambda: rate_catalog(user, restaurants, features),
+        'k_means': lambda: k_means(restaurant_list, 10, max_updates=10),
+        'dbscan': lambda: dbscan(restaurant_list, 20),
+        'draw_map': lambda: write_map(centroids, restaurant_list, ratings, path),
+        'group_by_first': lambda: group_by_first(pairs),
+    }
+    for name in names:
+        if name in benchmarks:
+            times[name] = timed(benchmarks[name])[0]
+    return {name: times[name] for name in names}
+
+def rate_catalog(user, restaurants, feature_fns):
+    """Return rate_all(USER, RESTAURANTS, FEATURE_FNS), with RESTAURANTS in
+    place of recommend.RESTAURANTS, so that the predictor is fit to the
+    synthetic catalog and the data in data/ is never loaded."""
+    saved = vars(recommend).pop('RESTAURANTS', None)
+    recommend.RESTAURANTS = restaurants
+    try:
+        return rate_all(user, restaurants, feature_fns)
+    finally:
+        del recommend.RESTAURANTS
+        if saved is not None:
+            recommend.RESTAURANTS = saved
+
+BENCHMARKS = ['load_data', 'search', 'best_predictor', 'rate_all', 'k_means',
+              'dbscan', 'draw_map', 'group_by_first']
+
+def scaling_curves(sizes, names=BENCHMARKS, budget=10, seed=0):
+    """Return a dictionary from each of NAMES to a list of [n, seconds] for
+    each of SIZES. A benchmark that takes more than BUDGET seconds is not run
+    at larger sizes."""
+    curves = {name: [] for name in names}
+    for n in sorted(sizes):
+        running = [name for name in names
+                   if not curves[name] or curves[name][-1][1] <= budget]
+        if not running:
+            break
+        times = run_benchmarks(n, running, seed)
+        for name in running:
+            curves[name].append([n, times[name]])
+    return curves
+
+def growth_exponent(curve):
+    """Return the exponent e for which time grows like n ** e along CURVE, the
+    slope of the least-squares line through its points on a log-log scale.
+    Points under a millisecond are too noisy to use; None is returned if fewer
+    than two points remain.
+
+    >>> growth_exponent([[100, 0.0001], [1000, 0.5], [10000, 50.0]])
+    2.0
+    """
+    points = [[log(n), log(t)] for n, t in curve if t >= 1e-3]
+    if len(points) < 2:
+        return None
+    mean_x = sum([x for x, _ in points]) / len(points)
+    mean_y = sum([y for _, y in points]) / len(points)
+    sxx = sum([(x - mean_x) ** 2 for x, _ in points])
+    sxy = sum([(x - mean_x) * (y - mean_y) for x, y in points])
+    return round(sxy / sxx, 2)
+
+def report(curves, quadratic=1.6):
+    """Print a table of CURVES, flagging benchmarks whose time grows at least
+    like n ** QUADRATIC."""
+    sizes = sorted({n for curve in curves.values() for n, _ in curve})
+    print('{:16}'.format('n') + ''.join('{:>11}'.format(n) for n in sizes) +
+          '{:>8}'.format('growth'))
+    for name, curve in curves.items():
+        seconds = dict(curve)
+        cells = ['{:>11.4f}'.format(seconds[n]) if n in seconds else '{:>11}'.format('-')
+                 for n in sizes]
+        e = growth_exponent(curve)
+        flag = ''
+        if e is not None and e >= quadratic:
+            flag = '  <- superlinear'
+        print('{:16}'.format(name) + ''.join(cells) +
+              '{:>8}'.format('' if e is None else e) + flag)
+
+@main
+def run(*args):
+    import argparse
+    parser = argparse.ArgumentParser(description='Time the program on synthetic data')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+',
+                        default=[1000, 3000, 10000, 30000],
+                        help='numbers of restaurants and users '
+                             '(default: 1000 3000 10000 30000)')
+    parser.add_argument('-b', '--benchmarks', nargs='+', default=BENCHMARKS,
+                        choices=BENCHMARKS, metavar='NAME',
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('-t', '--budget', type=float, default=10,
+                        help='seconds after which a benchmark is not run at '
+                             'larger sizes (default: 10)')
+    parser.add_argument('-o', '--output', help='write the curves as JSON')
+    args = parser.parse_args()
+    curves = scaling_curves(args.sizes, args.benchmarks, args.budget)
+    report(curves)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(curves, f)
@@ -0,0 +1,204 @@
+"""Collaborative filtering: predicting ratings from the ratings of similar users"""
+
+from array import array
+from heapq import nlargest
+from math import sqrt
+from threading import Lock
+
+from abstractions import *
+from utils import mean
+
+# Rating matrix
+
+def make_rating_matrix(users, restaurants):
+    """Return a sparse matrix of the ratings by USERS (a sequence of users) of
+    RESTAURANTS (a dictionary from names to restaurants).
+
+    Each user is a row and each restaurant a column. Only the ratings that
+    exist are stored, both row by row and column by column (the compressed
+    sparse row and column layouts), so memory grows with the number of
+    reviews rather than with users times restaurants.
+
+    >>> m = make_rating_matrix([make_user('Ann', [make_review('A', 4)]),
+    ...                         make_user('Bob', [make_review('B', 2),
+    ...                                           make_review('A', 5)])],
+    ...                        {'A': 'a', 'B': 'b'})
+    >>> matrix_row(m, 1)
+    {0: 5.0, 1: 2.0}
+    >>> matrix_column(m, 0)
+    {0: 4.0, 1: 5.0}
+    """
+    users = list(users)
+    names = list(restaurants)
+    column_of = {name: j for j, name in enumerate(names)}
+
+    row_starts, row_columns, row_values = array('l', [0]), array('l'), array('d')
+    for user in users:
+        entries = sorted([column_of[name], user_rating(user, name)]
+                         for name in user_reviews(user) if name in column_of)
+        for j, rating in entries:
+            row_columns.append(j)
+            row_values.append(rating)
+        row_starts.append(len(row_columns))
+
+    # Transpose by counting the entries of each column first
+    counts = [0] * len(names)
+    for j in row_columns:
+        counts[j] += 1
+    column_starts = array('l', [0])
+    for count in counts:
+        column_starts.append(column_starts[-1] + count)
+    column_rows = array('l', [0]) * len(row_columns)
+    column_values = array('d', [0]) * len(row_columns)
+    filled = list(column_starts[:-1])
+    for i in range(len(users)):
+        for k in range(row_starts[i], row_starts[i + 1]):
+            j = row_columns[k]
+            column_rows[filled[j]] = i
+            column_values[filled[j]] = row_values[k]
+            filled[j] += 1
+
+    # Each user's mean rating, and the length of the user's rating vector
+    # before and after subtracting that mean
+    means, norms, centered_norms = array('d'), array('d'), array('d')
+    for i in range(len(users)):
+        values = row_values[row_starts[i]:row_starts[i + 1]]
+        m = mean(values) if values else 0
+        means.append(m)
+        norms.append(sqrt(sum([v * v for v in values])))
+        centered_norms.append(sqrt(sum([(v - m) ** 2 for v in values])))
+
+    return {'users': users, 'names': names, 'column_of': column_of,
+            'row_starts': row_starts, 'row_columns': row_columns,
+            'row_values': row_values, 'column_starts': column_starts,
+            'column_rows': column_rows, 'column_values': column_values,
+            'means': means, 'norms': norms, 'centered_norms': centered_norms}
+
+def matrix_row(matrix, i):
+    """Return a dictionary from columns to the ratings in row I of MATRIX."""
+    starts, columns, values = (matrix['row_starts'], matrix['row_columns'],
+                               matrix['row_values'])
+    return {columns[k]: values[k] for k in range(starts[i], starts[i + 1])}
+
+def matrix_column(matrix, j):
+    """Return a dictionary from rows to the ratings in column J of MATRIX."""
+    starts, rows, values = (matrix['column_starts'], matrix['column_rows'],
+                            matrix['column_values'])
+    return {rows[k]: values[k] for k in range(starts[j], starts[j + 1])}
+
+# Similarity
+
+def user_vector(matrix, user):
+    """Return a dictionary from the columns of MATRIX to the ratings by USER,
+    who need not be one of its rows."""
+    column_of = matrix['column_of']
+    return {column_of[name]: user_rating(user, name)
+            for name in user_reviews(user) if name in column_of}
+
+def similarities(matrix, ratings, similarity='cosine', exclude=None):
+    """Return a dictionary from rows of MATRIX to their similarity to RATINGS
+    (a dictionary from columns to ratings). Row EXCLUDE, if given, is left out.
+
+    SIMILARITY is 'cosine' for the cosine of the angle between rating vectors,
+    or 'pearson' for the cosine after subtracting each user's mean rating.
+    Only rows that share a rated column with RATINGS are ever visited, and
+    only they are included.
+    """
+    assert similarity in ('cosine', 'pearson'), 'unknown similarity'
+    pearson = similarity == 'pearson'
+    starts, rows, values = (matrix['column_starts'], matrix['column_rows'],
+                            matrix['column_values'])
+    means = matrix['means']
+    norms = matrix['centered_norms'] if pearson else matrix['norms']
+
+    own_mean = mean(list(ratings.values())) if pearson and ratings else 0
+    own = {j: r - own_mean for j, r in ratings.items()}
+    own_norm = sqrt(sum([x * x for x in own.values()]))
+    if own_norm == 0:
+        return {}
+
+    dots = {}
+    for j, x in own.items():
+        for k in range(starts[j], starts[j + 1]):
+            i = rows[k]
+            y = values[k] - means[i] if pearson else values[k]
+            dots[i] = dots.get(i, 0) + x * y
+    dots.pop(exclude, None)
+    return {i: d / (own_norm * norms[i]) for i, d in dots.items() if norms[i] > 0}
+
+def similar_users(matrix, ratings, k, similarity='cosine', exclude=None):
+    """Return up to K pairs [similarity, row] for the rows of MATRIX that are
+    most similar to RATINGS, most similar first, as found by similarities."""
+    scored = similarities(matrix, ratings, similarity, exclude).items()
+    return nlargest(k, [[s, i] for i, s in scored])
+
+# Prediction
+
+def collaborative_ratings(matrix, user, k=20, similarity='pearson'):
+    """Return a function that predicts the rating by USER of a restaurant name
+    from the ratings of that restaurant by the K users in MATRIX most similar
+    to USER among those who rated it.
+
+    With 'pearson' similarity a prediction is the user's mean rating plus the
+    similarity-weighted mean of the neighbors' deviations from their means;
+    with 'cosine' it is the similarity-weighted mean of their ratings. When no
+    similar user rated the restaurant, the user's mean rating is predicted.
+    Predictions are clamped to 1 to 5 stars.
+
+    >>> users = [make_user('Ann', [make_review('A', 5), make_review('B', 1)]),
+    ...          make_user('Bob', [make_review('A', 5), make_review('C', 4)]),
+    ...          make_user('Cat', [make_review('A', 1), make_review('B', 5),
+    ...                            make_review('C', 1)])]
+    >>> m = make_rating_matrix(users, {'A': 'a', 'B': 'b', 'C': 'c'})
+    >>> predict = collaborative_ratings(m, users[0], k=1, similarity='cosine')
+    >>> predict('C') # Only Bob and Cat rated C, and Bob is more like Ann
+    4.0
+    """
+    users, column_of, means = matrix['users'], matrix['column_of'], matrix['means']
+    starts, rows, values = (matrix['column_starts'], matrix['column_rows'],
+                            matrix['column_values'])
+    ratings = user_vector(matrix, user)
+    exclude = next((i for i, u in enumerate(users) if u is user), None)
+    similar = similarities(matrix, ratings, similarity, exclude)
+    pearson = similarity == 'pearson'
+    own_mean = mean(list(ratings.values())) if ratings else 0
+
+    def predict(name):
+        j = column_of.get(name)
+        raters = [] if j is None else range(starts[j], starts[j + 1])
+        # The K most similar users among those who rated the restaurant,
+        # found from its column
+        neighbors = nlargest(k, [[similar[rows[x]], rows[x], values[x]]
+                                 for x in raters if rows[x] in similar])
+        total = weight = 0
+        for s, i, rating in neighbors:
+            total += s * (rating - means[i] if pearson else rating)
+            weight += abs(s)
+        if weight == 0:
+            prediction = own_mean
+        elif pearson:
+            prediction = own_mean + total / weight
+        else:
+            prediction = total / weight
+        return min(5, max(1, prediction))
+    return predict
+
+_matrix = []
+_matrix_lock = Lock() # Threads of the service may build the matrix at once
+
+def collaborative_predictor(user, restaurants, feature_fns):
+    """Return a predictor for USER based on the ratings of similar users in
+    data.USERS. It has the same signature as best_predictor; RESTAURANTS and
+    FEATURE_FNS are not needed, since the predictor uses no features.
+
+    The rating matrix is built from the loaded data the first time it is
+    needed, so reviews added later with ingest.add_review are not included.
+    """
+    with _matrix_lock:
+        if not _matrix:
+            import data
+            _matrix.append(make_rating_matrix(data.USERS, data.RESTAURANTS))
+    predict = collaborative_ratings(_matrix[0], user)
+    def predictor(restaurant):
+        return predict(restaurant_name(restaurant))
+    return predictor
@@ -1,90 +1,232 @@
+import ast
 import collections
+import glob
 import os
 
 from abstractions import *
 import data.jsonl
+from data.snapshot import cached
 
 DATA_DIRECTORY = 'data'
 USER_DIRECTORY = 'users'
+SNAPSHOT = os.path.join(DATA_DIRECTORY, '.snapshot.marshal')
 
 def load_data(user_dataset, review_dataset, restaurant_dataset):
-    with open(os.path.join(DATA_DIRECTORY, user_dataset)) as f:
-        user_data = jsonl.load(f)
-    with open(os.path.join(DATA_DIRECTORY, review_dataset)) as f:
-        review_data = jsonl.load(f)
-    with open(os.path.join(DATA_DIRECTORY, restaurant_dataset)) as f:
-        restaurant_data = jsonl.load(f)
-
-    # Load users.
-    userid_to_user = {}
-    for user in user_data:
-        name = user['name']
-        _user_id = user['user_id']
-        user = make_user(name, []) # MISSING: reviews
-
-        userid_to_user[_user_id] = user
-
-    # Load restaurants.
-    busid_to_restaurant = {}
-    for restaurant in restaurant_data:
-        name = restaurant['name']
-        location = float(restaurant['latitude']), float(restaurant['longitude'])
-        categories = restaurant['categories']
-        price = restaurant['price']
-        if price is not None:
-            price = int(price)
-        num_reviews = int(restaurant['review_count'])
+    """Return a list of users, a list of reviews, and a dictionary from names
+    to restaurants, read from the three datasets. The parsed data is kept in a
+    snapshot file, so the datasets are only parsed again after they change.
+    """
+    datasets = user_dataset, review_dataset, restaurant_dataset
+    sources = [os.path.join(DATA_DIRECTORY, d) for d in datasets]
+    users, reviews, restaurant_fields = cached(SNAPSHOT, sources,
+                                               lambda: parse_data(*datasets))
+
+    # Restaurants live in the columns of this process, so they are made here
+    # rather than saved in the snapshot.
+    restaurants = {}
+    for fields in restaurant_fields:
+        restaurant = make_restaurant(*fields)
+        restaurants[restaurant_name(restaurant)] = restaurant
+    return users, reviews, restaurants
 
-        _business_id = restaurant['business_id']
-        restaurant = make_restaurant(name, location, categories, price, []) # MISSING: reviews
-        busid_to_restaurant[_business_id] = restaurant
+def parse_data(user_dataset, review_dataset, restaurant_dataset):
+    """Return a list of users, a list of reviews, and a list of restaurant
+    fields [name, location, categories, price, reviews], parsed from the three
+    datasets."""
+    # Load restaurants. Each restaurant is made once its reviews are known, so
+    # only its fields are collected here.
+    busid_to_fields = dict(read_restaurants(restaurant_dataset))
+    busid_to_name = {busid: fields[0] for busid, fields in busid_to_fields.items()}
+
+    # Load users, keeping only their names until their reviews are known.
+    userid_to_name = {user['user_id']: user['name']
+                      for user in read_records(user_dataset)}
 
     # Load reviews.
     reviews = []
     busid_to_reviews = collections.defaultdict(list)
     userid_to_reviews = collections.defaultdict(list)
-    for review in review_data:
-        _user_id = review['user_id']
-        _business_id = review['business_id']
-
-        restaurant = restaurant_name(busid_to_restaurant[_business_id])
-        rating = float(review['stars'])
-
-        review = make_review(restaurant, rating)
+    for _user_id, _business_id, review in read_reviews(review_dataset, busid_to_name):
         reviews.append(review)
         busid_to_reviews[_business_id].append(review)
         userid_to_reviews[_user_id].append(review)
     # Reviews done.
 
-    restaurants = {}
-    for busid, restaurant in busid_to_restaurant.items():
-        name = restaurant_name(restaurant)
-        location = list(restaurant_location(restaurant))
-        categories = restaurant_categories(restaurant)
-        price = restaurant_price(restaurant)
-        restaurant_reviews = busid_to_reviews[busid]
-
-        restaurant = make_restaurant(name, location, categories, price, restaurant_reviews)
-        restaurants[name] = restaurant
+    restaurant_fields = []
+    for busid, fields in busid_to_fields.items():
+        restaurant_fields.append(fields + [busid_to_reviews[busid]])
     # Restaurants done.
 
     users = []
-    for userid, user in userid_to_user.items():
-        name = user_name(user)
-        user_reviews = userid_to_reviews[userid]
-
-        user = make_user(name, user_reviews)
-        users.append(user)
+    for userid, name in userid_to_name.items():
+        users.append(make_user(name, userid_to_reviews[userid]))
     # Users done.
 
-    return users, reviews, restaurants
+    return users, reviews, restaurant_fields
 
-USERS, REVIEWS, RESTAURANTS = load_data('users.json', 'reviews.json', 'restaurants.json')
-CATEGORIES = {c for r in RESTAURANTS.values() for c in restaurant_categories(r)}
+def read_records(dataset):
+    """Yield the records of DATASET, a file of newline-delimited JSON, one at
+    a time."""
+    with open(os.path.join(DATA_DIRECTORY, dataset)) as f:
+        yield from jsonl.iterload(f)
 
-def load_user_file(user_file):
-    with open(os.path.join(USER_DIRECTORY, user_file)) as f:
-        return eval(f.read())
+def read_restaurants(restaurant_dataset, category=None):
+    """Yield [business_id, [name, location, categories, price]] for each
+    restaurant in RESTAURANT_DATASET, or only for those in CATEGORY."""
+    for restaurant in read_records(restaurant_dataset):
+        categories = restaurant['categories']
+        if category is not None and category not in categories:
+            continue
+        name = restaurant['name']
+        location = [float(restaurant['latitude']), float(restaurant['longitude'])]
+        price = restaurant['price']
+        if price is not None:
+            price = int(price)
+        yield [restaurant['business_id'], [name, location, categories, price]]
+
+def read_reviews(review_dataset, busid_to_name, user_ids=None):
+    """Yield [user_id, business_id, review] for each review in REVIEW_DATASET
+    of a restaurant in BUSID_TO_NAME, a dictionary from business IDs to
+    restaurant names. If USER_IDS is given, only reviews by those users are
+    yielded."""
+    for review in read_records(review_dataset):
+        _user_id = review['user_id']
+        _business_id = review['business_id']
+        if _business_id not in busid_to_name:
+            continue
+        if user_ids is not None and _user_id not in user_ids:
+            continue
+        rating = float(review['stars'])
+        review = make_review(busid_to_name[_business_id], rating)
+        yield [_user_id, _business_id, review]
+
+def load_restaurants(category=None, review_dataset='reviews.json',
+                     restaurant_dataset='restaurants.json'):
+    """Return a dictionary from names to restaurants in CATEGORY (default: all
+    restaurants), with their reviews. Records are streamed, so only the
+    selected restaurants and their reviews are kept in memory."""
+    busid_to_fields = dict(read_restaurants(restaurant_dataset, category))
+    busid_to_name = {busid: fields[0] for busid, fields in busid_to_fields.items()}
+    busid_to_reviews = collections.defaultdict(list)
+    for _, _business_id, review in read_reviews(review_dataset, busid_to_name):
+        busid_to_reviews[_business_id].append(review)
 
-import glob
-USER_FILES = [f[6:-4] for f in glob.glob('users/*.dat')]
+    restaurants = {}
+    for busid, fields in busid_to_fields.items():
+        restaurant = make_restaurant(*fields, busid_to_reviews[busid])
+        restaurants[restaurant_name(restaurant)] = restaurant
+    return restaurants
+
+def load_user(name, user_dataset='users.json', review_dataset='reviews.json',
+              restaurant_dataset='restaurants.json'):
+    """Return the first user called NAME in USER_DATASET, with only the reviews
+    by that user. Records are streamed, so the other users and their reviews
+    are never kept in memory."""
+    for user in read_records(user_dataset):
+        if user['name'] == name:
+            user_ids = {user['user_id']}
+            break
+    else:
+        raise ValueError('no user named {}'.format(name))
+    busid_to_name = {busid: fields[0]
+                     for busid, fields in read_restaurants(restaurant_dataset)}
+    reviews = [review for _, _, review
+               in read_reviews(review_dataset, busid_to_name, user_ids)]
+    return make_user(name, reviews)
+
+def __getattr__(name):
+    """Load USERS, REVIEWS, RESTAURANTS and CATEGORIES the first time that one
+    of them is used, USER_PROFILES, a dictionary of the users in the user
+    files, the first time that it is used, and USER_FILES, the names of the
+    user files, the first time that it is used."""
+    global USERS, REVIEWS, RESTAURANTS, CATEGORIES, USER_PROFILES, USER_FILES
+    if name == 'USER_PROFILES':
+        USER_PROFILES = load_user_files()
+        return USER_PROFILES
+    if name == 'USER_FILES':
+        pattern = os.path.join(USER_DIRECTORY, '*.dat')
+        USER_FILES = [os.path.basename(f)[:-4] for f in glob.glob(pattern)]
+        return USER_FILES
+    if name not in ('USERS', 'REVIEWS', 'RESTAURANTS', 'CATEGORIES'):
+        raise AttributeError("module 'data' has no attribute " + repr(name))
+    USERS, REVIEWS, RESTAURANTS = load_data('users.json', 'reviews.json', 'restaurants.json')
+    CATEGORIES = {c for r in RESTAURANTS.values() for c in restaurant_categories(r)}
+    return globals()[name]
+
+def load_user_file(user_file):
+    """Return the user in USER_FILE, a file in USER_DIRECTORY."""
+    path = os.path.join(USER_DIRECTORY, user_file)
+    return make_user_from_fields(parse_user_file(path))
+
+def load_user_files(directory=None, processes=None):
+    """Return a dictionary from the name of each user file in DIRECTORY
+    (default: USER_DIRECTORY), without .dat, to its user.
+
+    The files are parsed in a pool of PROCESSES worker processes (default: one
+    per CPU) when there are many of them. The parsed users are kept in a
+    snapshot file, so the files are only parsed again after one changes.
+    """
+    directory = directory or USER_DIRECTORY
+    paths = sorted(glob.glob(os.path.join(directory, '*.dat')))
+    snapshot = os.path.join(directory, '.users.marshal')
+    fields = cached(snapshot, paths, lambda: parse_user_files(paths, processes))
+    names = [os.path.basename(path)[:-4] for path in paths]
+    return {name: make_user_from_fields(f) for name, f in zip(names, fields)}
+
+def parse_user_files(paths, processes=None):
+    """Return the fields of the user in each file in PATHS."""
+    if processes == 1 or len(paths) < 64:
+        return [parse_user_file(path) for path in paths]
+    from multiprocessing import Pool
+    with Pool(processes) as pool:
+        return pool.map(parse_user_file, paths, chunksize=16)
+
+def parse_user_file(path):
+    """Return [name, reviews] for the user in the file at PATH, where reviews is
+    a list of [restaurant name, rating] pairs.
+
+    A user file holds a single make_user call whose reviews are make_review
+    calls. It is parsed rather than evaluated, so a file cannot run any code.
+    """
+    with open(path) as f:
+        text = f.read()
+    try:
+        return parse_user(text)
+    except (SyntaxError, ValueError) as e:
+        raise ValueError('{}: {}'.format(path, e)) from None
+
+def parse_user(text):
+    """Return [name, reviews] for the user written as TEXT.
+
+    >>> parse_user("make_user('Ann', [make_review('Cafe 3', 4.5)])  # Ann")
+    ['Ann', [['Cafe 3', 4.5]]]
+    >>> parse_user("make_user('Ann', [print('hi')])")
+    Traceback (most recent call last):
+        ...
+    ValueError: expected make_review(...) on line 1
+    """
+    name, reviews = call_arguments(ast.parse(text, mode='eval').body, 'make_user')
+    name = ast.literal_eval(name)
+    if not isinstance(name, str):
+        raise ValueError('user name must be a string')
+    if not isinstance(reviews, ast.List):
+        raise ValueError('expected a list of reviews on line {}'.format(reviews.lineno))
+    pairs = []
+    for review in reviews.elts:
+        restaurant, rating = map(ast.literal_eval, call_arguments(review, 'make_review'))
+        if not isinstance(restaurant, str) or not isinstance(rating, (int, float)):
+            raise ValueError('bad review on line {}'.format(review.lineno))
+        pairs.append([restaurant, rating])
+    return [name, pairs]
+
+def call_arguments(node, function):
+    """Return the two arguments of NODE, a call of FUNCTION."""
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+            node.func.id == function and len(node.args) == 2 and
+            not node.keywords):
+        raise ValueError('expected {}(...) on line {}'.format(function, node.lineno))
+    return node.args
+
+def make_user_from_fields(fields):
+    name, pairs = fields
+    return make_user(name, [make_review(r, rating) for r, rating in pairs])
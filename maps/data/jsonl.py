@@ -9,7 +9,12 @@ True
 from json import loads, dumps
 
 def load(fp, **kw):
-    return [loads(obj, **kw) for obj in fp]
+    return list(iterload(fp, **kw))
+
+def iterload(fp, **kw):
+    """Yield the objects in FP one at a time, without reading the whole file."""
+    for obj in fp:
+        yield loads(obj, **kw)
 
 def dump(objs, fp, **kw):
     for obj in objs:
@@ -0,0 +1,84 @@
+"""Binary snapshots of parsed data, so that unchanged data files are not
+parsed again.
+
+Snapshots are written with marshal rather than pickle, so loading a snapshot
+cannot run code. Parsed data must therefore be built from lists, dicts,
+strings, numbers and None.
+
+>>> import tempfile
+>>> directory = tempfile.mkdtemp()
+>>> source = os.path.join(directory, 'numbers.txt')
+>>> with open(source, 'w') as f:
+...     _ = f.write('1 2 3')
+>>> def parse():
+...     print('parsing')
+...     with open(source) as f:
+...         return [int(x) for x in f.read().split()]
+>>> path = os.path.join(directory, 'numbers.marshal')
+>>> cached(path, [source], parse)
+parsing
+[1, 2, 3]
+>>> cached(path, [source], parse)
+[1, 2, 3]
+
+A snapshot that cannot be loaded, such as a truncated one or one that holds
+something else, is rebuilt.
+
+>>> with open(path, 'r+b') as f:
+...     _ = f.truncate(20)
+>>> cached(path, [source], parse)
+parsing
+[1, 2, 3]
+>>> with open(path, 'wb') as f:
+...     _ = f.write(b'\\x00 garbage')
+>>> cached(path, [source], parse)
+parsing
+[1, 2, 3]
+>>> cached(path, [source], parse)
+[1, 2, 3]
+"""
+
+import os
+import marshal
+import tempfile
+
+# Bump when the layout of a snapshot's contents changes.
+VERSION = 2
+
+def source_key(sources):
+    """Return a key that changes whenever one of the files SOURCES changes."""
+    key = [VERSION]
+    for path in sources:
+        stat = os.stat(path)
+        key.append([os.path.basename(path), stat.st_mtime_ns, stat.st_size])
+    return key
+
+def cached(snapshot, sources, build):
+    """Return the result of calling BUILD, which reads the files SOURCES.
+
+    The result is saved in the file SNAPSHOT. Later calls load it from there
+    instead of calling BUILD, until one of SOURCES is modified.
+    """
+    key = source_key(sources)
+    try:
+        with open(snapshot, 'rb') as f:
+            if marshal.load(f) == key:
+                return marshal.load(f)
+    except Exception:
+        pass # Missing, damaged or unreadable snapshot: rebuild it
+
+    result = build()
+    try:
+        # Each writer gets its own temporary file, so concurrent writers
+        # never interleave and readers only ever see a complete snapshot.
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(snapshot) or '.')
+    except OSError:
+        return result # A read-only data directory only loses the speed-up
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(key, f)
+            marshal.dump(result, f)
+        os.replace(partial, snapshot)
+    except OSError:
+        os.remove(partial)
+    return result
@@ -0,0 +1,110 @@
+"""Cached feature values for rating predictors"""
+
+from array import array
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+# Each feature function has a column of values and a bytearray marking which
+# rows of the column hold a computed value, and each restaurant has a row that
+# is shared by every column. A value is computed the first time it is
+# requested. Columns are held weakly, so the column of a feature function that
+# is no longer used, such as a lambda made for one call, is freed with it.
+# The columns of the few callables that cannot be weakly referenced are held
+# in a plain dictionary.
+_rows = {}
+_columns = WeakKeyDictionary()
+_strong_columns = {}
+
+# Held while rows and columns are added or forgotten, so that threads that
+# use features at the same time, such as those of the service, cannot leave a
+# column shorter than a row that another thread has added.
+_lock = Lock()
+
+def feature_value(feature_fn, restaurant):
+    """Return FEATURE_FN(RESTAURANT), calling FEATURE_FN at most once for each
+    restaurant until its cached features are invalidated.
+
+    >>> calls = []
+    >>> def double(x):
+    ...     calls.append(x)
+    ...     return 2 * x
+    >>> feature_value(double, 1.5), feature_value(double, 1.5), calls
+    (3.0, 3.0, [1.5])
+    >>> invalidate_features(1.5)
+    >>> feature_value(double, 1.5), calls
+    (3.0, [1.5, 1.5])
+    """
+    with _lock:
+        column, filled, row = _slot(feature_fn, restaurant)
+        if filled[row]:
+            return column[row]
+    # FEATURE_FN is called without the lock, so it may use features itself
+    column[row] = feature_fn(restaurant)
+    filled[row] = 1
+    return column[row]
+
+def set_feature_value(feature_fn, restaurant, value):
+    """Cache VALUE as FEATURE_FN(RESTAURANT), for a caller that can update a
+    feature more cheaply than FEATURE_FN can recompute it.
+
+    >>> set_feature_value(abs, -2.5, 7)
+    >>> feature_value(abs, -2.5)
+    7.0
+    """
+    with _lock:
+        column, filled, row = _slot(feature_fn, restaurant)
+        column[row] = value
+        filled[row] = 1
+
+def _slot(feature_fn, restaurant):
+    """Return the column and filled marks of FEATURE_FN, and the row of
+    RESTAURANT, adding them if they are new. Call it only while holding
+    _lock."""
+    row = _rows.get(restaurant)
+    if row is None:
+        row = _rows[restaurant] = len(_rows)
+    entry = _columns.get(feature_fn) or _strong_columns.get(feature_fn)
+    if entry is None:
+        entry = [array('d'), bytearray()]
+        try:
+            _columns[feature_fn] = entry
+        except TypeError:
+            _strong_columns[feature_fn] = entry
+    column, filled = entry
+    if row >= len(column):
+        missing = len(_rows) - len(column)
+        column.extend([0.0] * missing)
+        filled.extend(bytes(missing))
+    return column, filled, row
+
+def feature_values(feature_fn, restaurants):
+    """Return a list of FEATURE_FN applied to each of RESTAURANTS, using the
+    cached value wherever one exists.
+
+    >>> feature_values(abs, [-1, 2, -3])
+    [1.0, 2.0, 3.0]
+    >>> columns = len(_columns)
+    >>> feature_values(lambda x: -x, [-1, 2])
+    [1.0, -2.0]
+    >>> len(_columns) == columns # The lambda and its column are freed
+    True
+    """
+    return [feature_value(feature_fn, r) for r in restaurants]
+
+def invalidate_features(restaurant=None):
+    """Forget the cached features of RESTAURANT, or of every restaurant if no
+    RESTAURANT is given. Call this whenever the reviews of a restaurant change,
+    and forget every restaurant whenever the restaurants are reset.
+    """
+    with _lock:
+        if restaurant is None:
+            _rows.clear()
+            _columns.clear()
+            _strong_columns.clear()
+            return
+        row = _rows.get(restaurant)
+        if row is not None:
+            entries = list(_columns.values()) + list(_strong_columns.values())
+            for _, filled in entries:
+                if row < len(filled):
+                    filled[row] = 0
@@ -0,0 +1,280 @@
+"""Indexes for finding restaurants without scanning all of them"""
+
+import re
+from array import array
+from heapq import heappush, heapreplace
+from itertools import product
+from math import cos, floor, hypot, radians
+
+from abstractions import *
+from utils import mean
+
+# Category queries
+
+# Categories may contain lower-case words, spaces, '&' and parentheses, as in
+# 'Beer, Wine & Spirits' and 'American (New)', so the operators are upper-case
+# words and there is no grouping. NOT binds tightest, then AND, then OR.
+_OPERATORS = re.compile(r'\b(AND|OR|NOT)\b')
+
+def parse_query(query):
+    """Return a category QUERY as a list of clauses, one for each alternative
+    separated by OR. A clause is a list of [category, negated] pairs that must
+    all hold.
+
+    >>> parse_query('Pizza')
+    [[['Pizza', False]]]
+    >>> parse_query('Thai OR Coffee & Tea AND NOT Cafes')
+    [[['Thai', False]], [['Coffee & Tea', False], ['Cafes', True]]]
+    >>> parse_query('Pizza AND OR Thai')
+    Traceback (most recent call last):
+        ...
+    ValueError: malformed query: Pizza AND OR Thai
+    """
+    clauses, clause, negated, need_category = [], [], False, True
+    for token in _OPERATORS.split(query):
+        token = token.strip()
+        if not token:
+            continue
+        if token == 'NOT' and need_category:
+            negated = not negated
+        elif token in ('AND', 'OR') and not need_category:
+            if token == 'OR':
+                clauses.append(clause)
+                clause = []
+            need_category = True
+        elif token not in ('AND', 'OR', 'NOT') and need_category:
+            clause.append([token, negated])
+            negated, need_category = False, False
+        else:
+            raise ValueError('malformed query: ' + query)
+    if need_category:
+        raise ValueError('malformed query: ' + query)
+    clauses.append(clause)
+    return clauses
+
+def query_categories(clauses):
+    """Return the set of categories mentioned in parsed query CLAUSES."""
+    return {category for clause in clauses for category, _ in clause}
+
+def query_matches(clauses, categories):
+    """Return whether a restaurant with CATEGORIES satisfies parsed query
+    CLAUSES.
+
+    >>> clauses = parse_query('Thai OR Pizza AND NOT Bars')
+    >>> [query_matches(clauses, c) for c in [['Thai'], ['Pizza', 'Bars'], []]]
+    [True, False, False]
+    """
+    return any(all((category in categories) != negated
+                   for category, negated in clause)
+               for clause in clauses)
+
+# Category index
+
+def make_category_index(restaurants):
+    """Return an index of RESTAURANTS by category.
+
+    The index holds the restaurants in order, a dictionary from each category
+    to a bitset (an int) whose i-th bit is set if the i-th restaurant has that
+    category, and a bitset of all restaurants.
+    """
+    restaurants = list(restaurants)
+    positions = {}
+    for i, restaurant in enumerate(restaurants):
+        for category in restaurant_categories(restaurant):
+            positions.setdefault(category, []).append(i)
+    bitsets = {category: to_bitset(ps, len(restaurants))
+               for category, ps in positions.items()}
+    return [restaurants, bitsets, (1 << len(restaurants)) - 1]
+
+def index_restaurants(index):
+    return index[0]
+
+def index_bitset(index, category):
+    return index[1].get(category, 0)
+
+def index_all(index):
+    return index[2]
+
+def search_index(query, index):
+    """Return the restaurants in INDEX that satisfy the category QUERY, in the
+    order they were indexed. The cost is a few bitset operations per category
+    in QUERY rather than a scan of every restaurant's categories.
+
+    >>> index = make_category_index([
+    ...     make_restaurant('A', [0, 0], ['Thai', 'Bars'], 1, []),
+    ...     make_restaurant('B', [0, 0], ['Pizza'], 1, []),
+    ...     make_restaurant('C', [0, 0], ['Pizza', 'Bars'], 1, []),
+    ... ])
+    >>> [restaurant_name(r) for r in search_index('Bars AND NOT Thai OR Pizza', index)]
+    ['B', 'C']
+    """
+    everything = index_all(index)
+    found = 0
+    for clause in parse_query(query):
+        bits = everything
+        for category, negated in clause:
+            category_bits = index_bitset(index, category)
+            bits &= everything ^ category_bits if negated else category_bits
+        found |= bits
+    restaurants = index_restaurants(index)
+    return [restaurants[i] for i in from_bitset(found)]
+
+def to_bitset(positions, n):
+    """Return an int with the bits at POSITIONS set, where each is below N.
+
+    >>> bin(to_bitset([0, 3, 4], 5))
+    '0b11001'
+    """
+    bits = bytearray((n + 7) // 8)
+    for i in positions:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+def from_bitset(bits):
+    """Return the positions of the set bits of BITS, in increasing order.
+
+    >>> from_bitset(0b11001)
+    [0, 3, 4]
+    """
+    # Reading the binary digits as a string takes linear time, whereas peeling
+    # off one bit at a time would copy the whole int for every set bit.
+    digits = bin(bits)[:1:-1]
+    positions = []
+    i = digits.find('1')
+    while i >= 0:
+        positions.append(i)
+        i = digits.find('1', i + 1)
+    return positions
+
+# Grid index
+
+# Locations are projected onto a plane in meters around the mean latitude of
+# the indexed restaurants (an equirectangular projection), which is accurate
+# to well under 1% across a city. The plane is cut into square cells.
+METERS_PER_DEGREE = 111195
+
+def make_grid_index(restaurants, cell_size=250):
+    """Return an index of RESTAURANTS by location, using square cells that are
+    CELL_SIZE meters across.
+
+    The index holds the restaurants in order, a dictionary from each non-empty
+    cell [column, row] to the positions of its restaurants, the projected
+    coordinates of each restaurant, and the projection.
+    """
+    restaurants = list(restaurants)
+    locations = [restaurant_location(r) for r in restaurants]
+    lat0 = mean([lat for lat, _ in locations]) if locations else 0
+    projection = [METERS_PER_DEGREE * cos(radians(lat0)), METERS_PER_DEGREE,
+                  cell_size]
+    xs, ys, cells = array('d'), array('d'), {}
+    for i, location in enumerate(locations):
+        x, y = project(projection, location)
+        xs.append(x)
+        ys.append(y)
+        cells.setdefault(grid_cell(projection, x, y), []).append(i)
+    return [restaurants, cells, xs, ys, projection]
+
+def project(projection, location):
+    """Return the planar coordinates [x, y] in meters of LOCATION."""
+    x_scale, y_scale, _ = projection
+    return [location[1] * x_scale, location[0] * y_scale]
+
+def grid_cell(projection, x, y):
+    cell_size = projection[2]
+    return (floor(x / cell_size), floor(y / cell_size))
+
+def within(index, location, radius, among=None):
+    """Return the restaurants in INDEX within RADIUS meters of LOCATION, closest
+    first. If AMONG is given, only restaurants in AMONG are returned, so the
+    result of a category search can be narrowed down by distance.
+
+    >>> campus = [37.8719, -122.2585]
+    >>> index = make_grid_index([
+    ...     make_restaurant('Near', [37.8725, -122.2585], [], 1, []),
+    ...     make_restaurant('Far', [37.8800, -122.2585], [], 1, []),
+    ...     make_restaurant('Nearer', [37.8720, -122.2586], [], 1, []),
+    ... ])
+    >>> [restaurant_name(r) for r in within(index, campus, 500)]
+    ['Nearer', 'Near']
+    """
+    restaurants, cells, xs, ys, projection = index
+    x, y = project(projection, location)
+    x0, y0 = grid_cell(projection, x - radius, y - radius)
+    x1, y1 = grid_cell(projection, x + radius, y + radius)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > len(cells):
+        candidates = [ps for cell, ps in cells.items()
+                      if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1]
+    else:
+        candidates = [cells[cell] for cell in product(range(x0, x1 + 1),
+                                                      range(y0, y1 + 1))
+                      if cell in cells]
+    among = None if among is None else set(among)
+    found = []
+    for positions in candidates:
+        for i in positions:
+            d = hypot(xs[i] - x, ys[i] - y)
+            if d <= radius and (among is None or restaurants[i] in among):
+                found.append([d, i])
+    return [restaurants[i] for _, i in sorted(found)]
+
+def nearest(index, location, k, among=None):
+    """Return the K restaurants in INDEX closest to LOCATION, closest first. If
+    AMONG is given, only restaurants in AMONG are considered.
+
+    Cells are visited in rings of growing size around LOCATION, and the search
+    stops once no unvisited cell can hold a closer restaurant.
+
+    >>> campus = [37.8719, -122.2585]
+    >>> index = make_grid_index([
+    ...     make_restaurant('Near', [37.8725, -122.2585], [], 1, []),
+    ...     make_restaurant('Far', [37.8800, -122.2585], [], 1, []),
+    ...     make_restaurant('Nearer', [37.8720, -122.2586], [], 1, []),
+    ... ])
+    >>> [restaurant_name(r) for r in nearest(index, campus, 2)]
+    ['Nearer', 'Near']
+    >>> [restaurant_name(r) for r in nearest(index, campus, 5)]
+    ['Nearer', 'Near', 'Far']
+    """
+    restaurants, cells, xs, ys, projection = index
+    if k <= 0 or not cells:
+        return []
+    x, y = project(projection, location)
+    cx, cy = grid_cell(projection, x, y)
+    columns = [cell[0] for cell in cells]
+    rows = [cell[1] for cell in cells]
+    # Rings closer than the nearest non-empty cell, or beyond the farthest
+    # one, are empty, so they are skipped.
+    first = max(min(columns) - cx, cx - max(columns),
+                min(rows) - cy, cy - max(rows), 0)
+    last = max(max(columns) - cx, cx - min(columns),
+               max(rows) - cy, cy - min(rows))
+
+    among = None if among is None else set(among)
+    best = [] # A heap of [-distance, -position] for the closest K so far
+    for ring in range(first, last + 1):
+        for cell in ring_cells(cx, cy, ring):
+            for i in cells.get(cell, ()):
+                if among is not None and restaurants[i] not in among:
+                    continue
+                candidate = [-hypot(xs[i] - x, ys[i] - y), -i]
+                if len(best) < k:
+                    heappush(best, candidate)
+                elif candidate > best[0]:
+                    heapreplace(best, candidate)
+        # Every restaurant in a later ring is at least RING cells away
+        if len(best) == k and -best[0][0] <= ring * projection[2]:
+            break
+    return [restaurants[-i] for _, i in sorted(best, reverse=True)]
+
+def ring_cells(cx, cy, ring):
+    """Return the cells whose larger offset from [CX, CY] is exactly RING."""
+    if ring == 0:
+        return [(cx, cy)]
+    cells = []
+    for dx in range(-ring, ring + 1):
+        cells.append((cx + dx, cy - ring))
+        cells.append((cx + dx, cy + ring))
+    for dy in range(-ring + 1, ring):
+        cells.append((cx - ring, cy + dy))
+        cells.append((cx + ring, cy + dy))
+    return cells
@@ -0,0 +1,164 @@
+"""Adding reviews without reloading the data"""
+
+from abstractions import *
+from features import feature_value, set_feature_value, invalidate_features
+
+# Regression statistics of tracked users. _tracked maps the id of each tracked
+# user to [user, restaurants, feature_fns, y_shift, x_shifts, sums], where sums
+# holds [n, sum x, sum y, sum x*x, sum y*y, sum x*y] for each feature. Ratings
+# and feature values are shifted by a typical value before they are summed, so
+# that the sums stay small and Sxx = sum x*x - (sum x)**2 / n stays accurate.
+_tracked = {}
+
+# A dictionary from each restaurant to the ids of the tracked users who
+# reviewed it; these are the users whose statistics depend on its features.
+_reviewers = {}
+
+def track_user(user, restaurants, feature_fns):
+    """Start keeping the regression statistics of USER for each of FEATURE_FNS,
+    over the restaurants reviewed by USER in RESTAURANTS (a dictionary from
+    names to restaurants), so that incremental_predictor stays up to date as
+    reviews are added with add_review.
+    """
+    untrack_user(user)
+    reviewed = list(user_reviewed_restaurants(user, restaurants).values())
+    ys = [user_rating(user, restaurant_name(r)) for r in reviewed]
+    y_shift = ys[0] if ys else 0
+    x_shifts = [feature_value(fn, reviewed[0]) if reviewed else 0
+                for fn in feature_fns]
+    sums = [[0] * 6 for _ in feature_fns]
+    entry = [user, restaurants, list(feature_fns), y_shift, x_shifts, sums]
+    _tracked[id(user)] = entry
+    for restaurant, y in zip(reviewed, ys):
+        accumulate(entry, restaurant, y, 1)
+        _reviewers.setdefault(restaurant, set()).add(id(user))
+
+def untrack_user(user):
+    """Stop keeping the regression statistics of USER."""
+    entry = _tracked.pop(id(user), None)
+    if entry is not None:
+        for reviewers in _reviewers.values():
+            reviewers.discard(id(user))
+
+def accumulate(entry, restaurant, y, sign):
+    """Add (SIGN 1) or remove (SIGN -1) rating Y of RESTAURANT to or from the
+    statistics in tracked ENTRY, using the current features of RESTAURANT."""
+    _, _, feature_fns, y_shift, x_shifts, sums = entry
+    y = y - y_shift
+    for feature_fn, x_shift, s in zip(feature_fns, x_shifts, sums):
+        x = feature_value(feature_fn, restaurant) - x_shift
+        s[0] += sign
+        s[1] += sign * x
+        s[2] += sign * y
+        s[3] += sign * x * x
+        s[4] += sign * y * y
+        s[5] += sign * x * y
+
+def add_review(user, restaurant, rating):
+    """Record a review of RESTAURANT by USER with RATING, replacing any earlier
+    review of RESTAURANT by USER.
+
+    The number and mean of the restaurant's ratings are found from its running
+    total in constant time. An earlier review by USER is replaced only if that
+    review is counted among the restaurant's reviews; a review of equal rating
+    by another user is left alone. The statistics of every tracked user who
+    reviewed RESTAURANT are updated too, because its features have changed.
+
+    >>> user = make_user('Critic', [make_review('A', 1), make_review('B', 5)])
+    >>> restaurants = {
+    ...     'A': make_restaurant('A', [0, 0], [], 1, [make_review('A', 1)]),
+    ...     'B': make_restaurant('B', [0, 0], [], 3, [make_review('B', 5)]),
+    ...     'C': make_restaurant('C', [0, 0], [], 2, [make_review('C', 4)]),
+    ... }
+    >>> track_user(user, restaurants, [restaurant_price])
+    >>> pred = incremental_predictor(user)
+    >>> round(pred(restaurants['C']), 5)
+    3.0
+    >>> add_review(user, restaurants['C'], 1)
+    >>> pred = incremental_predictor(user)
+    >>> round(pred(restaurants['C']), 5)
+    2.33333
+    >>> c = restaurants['C']
+    >>> restaurant_num_ratings(c), restaurant_mean_rating(c)
+    (2, 2.5)
+
+    A review that USER made elsewhere, such as in a user file, is not counted
+    at the restaurant, so re-rating adds a review the first time.
+
+    >>> add_user_review(user, make_review('D', 4))
+    >>> d = make_restaurant('D', [0, 0], [], 2, [make_review('D', 4)])
+    >>> add_review(user, d, 1)
+    >>> restaurant_ratings(d)
+    [4, 1]
+    >>> add_review(user, d, 2)
+    >>> restaurant_ratings(d), restaurant_mean_rating(d)
+    ([4, 2], 3.0)
+    """
+    name = restaurant_name(restaurant)
+    earlier = user_reviews(user).get(name)
+    review = make_review(name, rating)
+
+    # Take the restaurant out of its reviewers' statistics while its features
+    # still have their old values; it is added back below with the new ones.
+    reviewer_ids = set(_reviewers.get(restaurant, ()))
+    for user_id in reviewer_ids:
+        entry = _tracked[user_id]
+        accumulate(entry, restaurant, user_rating(entry[0], name), -1)
+
+    add_restaurant_review(restaurant, review, earlier)
+    count = restaurant_num_ratings(restaurant)
+    mean = restaurant_rating_total(restaurant) / count
+    add_user_review(user, review)
+    invalidate_features(restaurant)
+    set_feature_value(restaurant_num_ratings, restaurant, count)
+    set_feature_value(restaurant_mean_rating, restaurant, mean)
+
+    entry = _tracked.get(id(user))
+    if entry is not None and entry[1].get(name) == restaurant:
+        _reviewers.setdefault(restaurant, set()).add(id(user))
+        reviewer_ids.add(id(user))
+    for user_id in reviewer_ids:
+        entry = _tracked[user_id]
+        accumulate(entry, restaurant, user_rating(entry[0], name), 1)
+
+def incremental_predictor(user):
+    """Return the predictor that best_predictor would return for tracked USER,
+    computed from the statistics kept by track_user and add_review in time
+    proportional to the number of features."""
+    _, _, feature_fns, y_shift, x_shifts, sums = _tracked[id(user)]
+    best = None
+    for feature_fn, x_shift, s in zip(feature_fns, x_shifts, sums):
+        a, b, r_squared = fit_sums(s, x_shift, y_shift)
+        if best is None or r_squared > best[3]:
+            best = [feature_fn, a, b, r_squared]
+    feature_fn, a, b, _ = best
+
+    def predictor(restaurant):
+        return b * feature_value(feature_fn, restaurant) + a
+    return predictor
+
+def fit_sums(sums, x_shift, y_shift):
+    """Return [a, b, r_squared] of the least-squares fit y = a + b * x, given
+    SUMS of values shifted by X_SHIFT and Y_SHIFT. If the x values are all
+    equal, as they are for a single review, the fit is the horizontal line
+    through the mean of y, with an R^2 of 0.
+
+    >>> fit_sums([1, 0, 0, 0, 0, 0], 2, 4)
+    [4.0, 0, 0]
+    >>> fit_sums([3, 0, 3, 0, 5, 0], 7, 0)
+    [1.0, 0, 0]
+    """
+    n, sx, sy, sxx, syy, sxy = sums
+    Sxx = sxx - sx * sx / n
+    Syy = syy - sy * sy / n
+    Sxy = sxy - sx * sy / n
+    # After reviews are replaced, round-off can leave a tiny spread where
+    # there is none; treat it as none.
+    if Sxx <= 1e-12 * sxx:
+        Sxx = 0
+    if Syy <= 1e-12 * syy:
+        Syy = 0
+    b = Sxy / Sxx if Sxx else 0
+    a = (y_shift + sy / n) - b * (x_shift + sx / n)
+    r_squared = pow(Sxy, 2) / (Sxx * Syy) if Sxx and Syy else 0
+    return [a, b, r_squared]
@@ -0,0 +1,150 @@
+"""Approximate lookup of users who reviewed similar sets of restaurants
+
+Each user is summarized by a MinHash signature of the set of restaurants they
+reviewed. The signature is cut into BANDS bands of ROWS values, and users who
+agree on every value of some band share a bucket. Two users whose sets have
+Jaccard similarity s share a bucket with probability 1 - (1 - s**ROWS)**BANDS,
+so more rows per band make the lookup stricter and more bands make it more
+forgiving.
+"""
+
+from random import Random
+from zlib import crc32
+
+from abstractions import *
+
+# A Mersenne prime larger than any 32-bit item hash
+_PRIME = (1 << 61) - 1
+
+def hash_functions(n, seed=0):
+    """Return N pairs [a, b], each of which defines the hash function
+    x -> (a * x + b) mod _PRIME."""
+    random = Random(seed)
+    return [[random.randrange(1, _PRIME), random.randrange(_PRIME)]
+            for _ in range(n)]
+
+def item_hash(name):
+    """Return a hash of string NAME that is the same in every process, unlike
+    the built-in hash of a string."""
+    return crc32(name.encode('utf-8'))
+
+def minhash_signature(names, functions):
+    """Return the MinHash signature of the set NAMES under hash FUNCTIONS: the
+    smallest hash value of any name, for each function.
+
+    >>> functions = hash_functions(4)
+    >>> minhash_signature({'A', 'B'}, functions) == minhash_signature({'B', 'A'}, functions)
+    True
+    """
+    xs = [item_hash(name) for name in names]
+    return tuple(min([(a * x + b) % _PRIME for x in xs]) for a, b in functions)
+
+def jaccard(s, t):
+    """Return the Jaccard similarity of sets S and T.
+
+    >>> jaccard({1, 2, 3}, {2, 3, 4})
+    0.5
+    """
+    if not s and not t:
+        return 0.0
+    return len(s & t) / len(s | t)
+
+def reviewed_names(user):
+    """Return the set of names of the restaurants reviewed by USER."""
+    return set(user_reviews(user))
+
+def make_lsh_index(users, bands=16, rows=4, seed=0):
+    """Return a locality-sensitive hashing index of USERS by the restaurants
+    they reviewed, using signatures of BANDS * ROWS values. Users who have not
+    reviewed any restaurant are left out.
+    """
+    functions = hash_functions(bands * rows, seed)
+    indexed, signatures = [], []
+    buckets = [{} for _ in range(bands)]
+    for user in users:
+        names = reviewed_names(user)
+        if not names:
+            continue
+        signature = minhash_signature(names, functions)
+        position = len(indexed)
+        indexed.append(user)
+        signatures.append(signature)
+        for band, key in enumerate(band_keys(signature, bands, rows)):
+            buckets[band].setdefault(key, []).append(position)
+    return {'users': indexed, 'signatures': signatures, 'buckets': buckets,
+            'functions': functions, 'bands': bands, 'rows': rows}
+
+def band_keys(signature, bands, rows):
+    """Return the part of SIGNATURE in each of BANDS bands of ROWS values."""
+    return [signature[band * rows:(band + 1) * rows] for band in range(bands)]
+
+def candidate_positions(index, signature):
+    """Return the set of positions of indexed users who share a bucket with
+    SIGNATURE."""
+    found = set()
+    keys = band_keys(signature, index['bands'], index['rows'])
+    for band, key in enumerate(keys):
+        found.update(index['buckets'][band].get(key, ()))
+    return found
+
+def similar_user_candidates(index, user):
+    """Return pairs [estimated similarity, user] for the indexed users that
+    likely reviewed a similar set of restaurants to USER, most similar first.
+    The estimate is the fraction of signature values that agree. USER itself is
+    never returned.
+
+    The cost depends on the number of bands and of candidates found, not on
+    the number of indexed users.
+
+    >>> users = [make_user('Ann', [make_review('A', 4), make_review('B', 3)]),
+    ...          make_user('Bob', [make_review('A', 5), make_review('B', 1)]),
+    ...          make_user('Cy', [make_review('C', 2)])]
+    >>> index = make_lsh_index(users)
+    >>> [[s, user_name(u)] for s, u in similar_user_candidates(index, users[0])]
+    [[1.0, 'Bob']]
+    """
+    names = reviewed_names(user)
+    if not names:
+        return []
+    signature = minhash_signature(names, index['functions'])
+    found = []
+    for position in candidate_positions(index, signature):
+        other = index['users'][position]
+        if other is user:
+            continue
+        agree = sum([x == y for x, y in
+                     zip(signature, index['signatures'][position])])
+        found.append([agree / len(signature), position])
+    found.sort(key=lambda pair: (-pair[0], pair[1]))
+    return [[s, index['users'][position]] for s, position in found]
+
+def lsh_recall(index, threshold=0.5):
+    """Return [recall, similar pairs, candidate pairs] for INDEX.
+
+    Similar pairs are the pairs of indexed users whose exact Jaccard
+    similarity is at least THRESHOLD. Candidate pairs are the pairs that share
+    some bucket. Recall is the fraction of similar pairs that are candidates.
+    Exact similarities are only computed for pairs that reviewed a common
+    restaurant, which are found through an inverted index.
+    """
+    users = index['users']
+    name_sets = [reviewed_names(u) for u in users]
+    reviewers = {}
+    for i, names in enumerate(name_sets):
+        for name in names:
+            reviewers.setdefault(name, []).append(i)
+    similar = set()
+    for i, names in enumerate(name_sets):
+        others = {j for name in names for j in reviewers[name] if j > i}
+        similar.update((i, j) for j in others
+                       if jaccard(names, name_sets[j]) >= threshold)
+
+    candidates = set()
+    for bucket in index['buckets']:
+        for positions in bucket.values():
+            for a in range(len(positions)):
+                for b in range(a + 1, len(positions)):
+                    candidates.add((positions[a], positions[b]))
+
+    recall = len(similar & candidates) / len(similar) if similar else 1.0
+    return [recall, len(similar), len(candidates)]
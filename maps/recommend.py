@@ -1,11 +1,41 @@
 """A Yelp-powered Restaurant Recommendation Program"""
 
 from abstractions import *
-from utils import distance, mean, zip, enumerate, sample
-from visualize import draw_map
-from data import RESTAURANTS, CATEGORIES, USER_FILES, load_user_file
+from features import feature_value, feature_values
+from index import parse_query, query_categories, query_matches
+from index import make_category_index, search_index
+from index import make_grid_index, within, nearest
+from collaborative import collaborative_predictor
+from utils import distance, mean, zip, enumerate, sample, dot
+from math import sqrt
+from heapq import nlargest
+from random import Random
+from threading import Lock
+from visualize import draw_map, write_map, load_visualization
+from timing import phase, record, count_calls, profile_report, save_profile
+import data
+from data import load_user_file
 from ucb import main, trace, interact
 
+# RESTAURANTS, CATEGORIES and USER_FILES are taken from data the first time
+# that they are used, so that importing this module loads no data. Code in this
+# module reaches RESTAURANTS through all_restaurants, since module __getattr__
+# does not apply to the names that a module's own functions look up.
+
+def __getattr__(name):
+    """Return RESTAURANTS, CATEGORIES or USER_FILES from data, keeping it."""
+    if name not in ('RESTAURANTS', 'CATEGORIES', 'USER_FILES'):
+        raise AttributeError("module 'recommend' has no attribute " + repr(name))
+    value = globals()[name] = getattr(data, name)
+    return value
+
+def all_restaurants():
+    """Return RESTAURANTS, a dictionary from names to every restaurant, which
+    may have been replaced by assigning recommend.RESTAURANTS."""
+    if 'RESTAURANTS' in globals():
+        return globals()['RESTAURANTS']
+    return __getattr__('RESTAURANTS')
+
 def find_closest(location, centroids):
     """Return the item in CENTROIDS that is closest to LOCATION. If two
     centroids are equally close, return the first one.
@@ -70,8 +100,58 @@ def k_means(restaurants, k, max_updates=100):
         res_list = group_by_centroid(restaurants, centroids)
         centroids = [find_centroid(r) for r in res_list]
         n += 1
+    record('k-means iterations', n)
     return centroids
 
+def dbscan(restaurants, radius, min_restaurants=4):
+    """Group RESTAURANTS into clusters of densely packed restaurants. A
+    restaurant is in a dense region if at least MIN_RESTAURANTS restaurants
+    (itself included) are within RADIUS meters of it, and a cluster is every
+    restaurant within RADIUS of a dense region joined through dense
+    restaurants. Each other restaurant is a cluster of its own.
+
+    Return a list of lists of restaurants, like group_by_centroid. Neighbors
+    are found with a grid index whose cells are RADIUS across, so each query
+    only visits nearby cells.
+
+    >>> restaurants = [make_restaurant(name, [37.87, -122.26 + dx / 1e4], [], 1, [])
+    ...                for name, dx in [['A', 0], ['B', 1], ['C', 2], ['D', 30]]]
+    >>> [[restaurant_name(r) for r in c] for c in dbscan(restaurants, 20, 2)]
+    [['A', 'B', 'C'], ['D']]
+    >>> dbscan(restaurants, 0)
+    Traceback (most recent call last):
+        ...
+    ValueError: radius must be positive
+    """
+    if not radius > 0:
+        raise ValueError('radius must be positive')
+    restaurants = list(restaurants)
+    index = make_grid_index(restaurants, cell_size=radius)
+    clusters, cluster_of = [], {}
+    for restaurant in restaurants:
+        if restaurant in cluster_of:
+            continue
+        neighbors = within(index, restaurant_location(restaurant), radius)
+        if len(neighbors) < min_restaurants:
+            continue # Noise, unless a dense neighbor claims it later
+        members = []
+        clusters.append(members)
+        pending = [restaurant]
+        while pending:
+            r = pending.pop()
+            if r in cluster_of:
+                continue
+            cluster_of[r] = len(clusters) - 1
+            members.append(r)
+            neighbors = within(index, restaurant_location(r), radius)
+            if len(neighbors) >= min_restaurants:
+                pending.extend(n for n in neighbors if n not in cluster_of)
+    order = {r: i for i, r in enumerate(restaurants)}
+    for members in clusters:
+        members.sort(key=lambda r: order[r])
+    noise = [[r] for r in restaurants if r not in cluster_of]
+    return clusters + noise
+
 def find_predictor(user, restaurants, feature_fn):
     """Return a rating predictor (a function from restaurants to ratings),
     for USER by performing least-squares linear regression using FEATURE_FN
@@ -82,130 +162,531 @@ def find_predictor(user, restaurants, feature_fn):
     restaurants -- A sequence of restaurants
     feature_fn -- A function that takes a restaurant and returns a number
     """
+    [[a, b, r_squared]] = fit_features(user, restaurants, [feature_fn])
+    return linear_predictor(feature_fn, a, b), r_squared
+
+def fit_features(user, restaurants, feature_fns):
+    """Return a list that contains [a, b, r_squared] for each function in
+    FEATURE_FNS, where a + b * feature_fn(r) is the least-squares fit of the
+    ratings by USER of the items in RESTAURANTS.
+
+    The ratings and their deviations from the mean are computed once and shared
+    by every feature, and each mean is computed once rather than per item.
+
+    Arguments:
+    user -- A user
+    restaurants -- A sequence of restaurants
+    feature_fns -- A sequence of functions that each takes a restaurant
+    """
     ## dictionary of (name: rating) pairs for a SINGLE user
     reviews_by_user = {review_restaurant_name(review): review_rating(review)
                        for review in user_reviews(user).values()}
 
-    xs = [feature_fn(r) for r in restaurants]
     ys = [reviews_by_user[restaurant_name(r)] for r in restaurants]
+    mean_y = mean(ys)
+    dys = [y - mean_y for y in ys]
+    Syy = sum([pow(dy, 2) for dy in dys])
+
+    fits = []
+    for feature_fn in feature_fns:
+        xs = feature_values(feature_fn, restaurants)
+        mean_x = mean(xs)
+        dxs = [x - mean_x for x in xs]
+
+        Sxx = sum([pow(dx, 2) for dx in dxs])
+        Sxy = sum([dx * dy for dx, dy in zip(dxs, dys)])
+
+        b = Sxy / Sxx
+        a = mean_y - b * mean_x
+        r_squared = pow(Sxy, 2) / (Sxx * Syy)
+        fits.append([a, b, r_squared])
+    return fits
+
+def linear_predictor(feature_fn, a, b):
+    """Return a predictor that rates a restaurant as A + B * FEATURE_FN(r)."""
+    def predictor(restaurant):
+        return b * feature_value(feature_fn, restaurant) + a
+    return predictor
+
+def best_predictor(user, restaurants, feature_fns):
+    """Find the feature within FEATURE_FNS that gives the highest R^2 value
+    for predicting ratings by the user; return a predictor using that feature.
+
+    Arguments:
+    user -- A user
+    restaurants -- A dictionary from restaurant names to restaurants
+    feature_fns -- A sequence of functions that each takes a restaurant
+    """
+    reviewed = list(user_reviewed_restaurants(user, restaurants).values())
+    feature_fns = list(feature_fns)
+    fits = fit_features(user, reviewed, feature_fns)
+    # The first feature wins ties, as with max
+    best = max(range(len(fits)), key=lambda i: fits[i][2])
+    a, b, _ = fits[best]
+    return linear_predictor(feature_fns[best], a, b)
+
+def cross_validated_predictor(user, restaurants, feature_fns, folds=5):
+    """Find the feature within FEATURE_FNS whose least-squares fit predicts
+    the held-out ratings by USER best under FOLDS-fold cross-validation; return
+    a predictor using that feature, fit to all of the user's ratings.
+
+    Unlike R^2, which only measures the fit to the ratings it was computed
+    from, cross-validation does not favor features that fit noise.
+
+    Arguments:
+    user -- A user
+    restaurants -- A dictionary from restaurant names to restaurants
+    feature_fns -- A sequence of functions that each takes a restaurant
+    folds -- The number of folds, at least 2 (more folds than reviewed
+             restaurants are treated as one fold per reviewed restaurant)
+    """
+    if folds < 2:
+        raise ValueError('cross-validation needs at least 2 folds')
+    reviewed = list(user_reviewed_restaurants(user, restaurants).values())
+    feature_fns = list(feature_fns)
+    if len(reviewed) < 2:
+        return best_predictor(user, restaurants, feature_fns)
+    # Folds are contiguous, so they are cut from a shuffled order
+    Random(0).shuffle(reviewed)
+    ys = [user_rating(user, restaurant_name(r)) for r in reviewed]
+    errors = [cross_validation_error(feature_values(fn, reviewed), ys, folds)
+              for fn in feature_fns]
+    # The first feature wins ties, as with min
+    best = min(range(len(errors)), key=lambda i: errors[i])
+    [[a, b, _]] = fit_features(user, reviewed, [feature_fns[best]])
+    return linear_predictor(feature_fns[best], a, b)
+
+def cross_validation_error(xs, ys, folds):
+    """Return the total squared error of predicting each of YS from XS with the
+    least-squares line fit to the other folds, for FOLDS contiguous folds.
+    FOLDS must be at least 2; more folds than values are treated as one fold
+    per value.
+
+    Every sum needed to fit and test a fold is the difference of two prefix
+    sums, so each fold takes constant time once they are computed. A training
+    set whose x values are all equal is fit with a horizontal line.
+
+    >>> cross_validation_error([1, 2, 3, 4], [2, 4, 6, 8], 2)
+    0.0
+    >>> cross_validation_error([1, 1, 1, 1], [1, 3, 1, 3], 4)
+    7.111111111111111
+    >>> cross_validation_error([1, 1, 1, 1], [1, 3, 1, 3], 10)
+    7.111111111111111
+    >>> cross_validation_error([1, 2, 3, 4], [2, 4, 6, 8], 1)
+    Traceback (most recent call last):
+        ...
+    ValueError: cross-validation needs at least 2 folds
+    >>> cross_validation_error([1], [2], 2)
+    Traceback (most recent call last):
+        ...
+    ValueError: cross-validation needs at least 2 values
+    """
+    n = len(ys)
+    if folds < 2:
+        raise ValueError('cross-validation needs at least 2 folds')
+    if n < 2:
+        raise ValueError('cross-validation needs at least 2 values')
+    folds = min(folds, n)
+    mean_x, mean_y = mean(xs), mean(ys)
+    dxs = [x - mean_x for x in xs]
+    dys = [y - mean_y for y in ys]
+    sums = [prefix_sums(column) for column in
+            [dxs, dys, [dx * dx for dx in dxs], [dx * dy for dx, dy in zip(dxs, dys)],
+             [dy * dy for dy in dys]]]
+    totals = [s[-1] for s in sums]
+
+    error = 0
+    for start, end in fold_bounds(n, folds):
+        held = [s[end] - s[start] for s in sums]
+        hx, hy, hxx, hxy, hyy = held
+        m, tn = end - start, n - (end - start)
+        sx, sy, sxx, sxy, _ = [t - h for t, h in zip(totals, held)]
+        Sxx = sxx - sx * sx / tn
+        Sxy = sxy - sx * sy / tn
+        b = Sxy / Sxx if Sxx > 1e-12 * sxx else 0
+        a = (sy - b * sx) / tn
+        # The sum of (y - a - b * x) ** 2 over the held-out fold, expanded
+        error += (hyy + m * a * a + b * b * hxx
+                  - 2 * a * hy - 2 * b * hxy + 2 * a * b * hx)
+    return error
+
+def prefix_sums(values):
+    """Return [0, v0, v0 + v1, ...] for VALUES.
+
+    >>> prefix_sums([3, 1, 2])
+    [0, 3, 4, 6]
+    """
+    sums = [0]
+    for v in values:
+        sums.append(sums[-1] + v)
+    return sums
+
+def fold_bounds(n, folds):
+    """Return [start, end] for each of FOLDS contiguous folds of N items, whose
+    sizes differ by at most one.
+
+    >>> fold_bounds(7, 3)
+    [[0, 2], [2, 4], [4, 7]]
+    """
+    return [[i * n // folds, (i + 1) * n // folds] for i in range(folds)]
+
+
+def find_multivariate_predictor(user, restaurants, feature_fns, ridge=0.1):
+    """Return a rating predictor for USER that is a linear function of all of
+    FEATURE_FNS together, fit by least squares on the items in RESTAURANTS.
+    Also, return the R^2 value of this model.
 
-    Sxx_list = [r - mean(xs) for r in xs]
-    Syy_list = [r - mean(ys) for r in ys]
-    Sxy_list = zip(Sxx_list, Syy_list)
+    The weights are shrunk toward 0 by a ridge penalty of RIDGE times the sum
+    of their squares (in units of each feature's spread), so that a few ratings
+    cannot give extreme weights, and predicted ratings are clamped to 1 to 5.
 
-    Sxx = sum([pow(r, 2) for r in Sxx_list])
-    Syy = sum([pow(r, 2) for r in Syy_list])
-    Sxy = sum([r[0] * r[1] for r in Sxy_list])
+    Arguments:
+    user -- A user
+    restaurants -- A sequence of restaurants
+    feature_fns -- A sequence of functions that each takes a restaurant
+    ridge -- The ridge penalty (0 for ordinary least squares)
+
+    >>> user = make_user('Foodie', [make_review('A', 2.5), make_review('B', 4.5),
+    ...                             make_review('C', 3.5), make_review('D', 4)])
+    >>> cluster = [
+    ...     make_restaurant('A', [0, 0], [], 1, [make_review('A', 2)]),
+    ...     make_restaurant('B', [0, 0], [], 3, [make_review('B', 4)]),
+    ...     make_restaurant('C', [0, 0], [], 4, [make_review('C', 1)]),
+    ...     make_restaurant('D', [0, 0], [], 2, [make_review('D', 4)]),
+    ... ]
+    >>> fns = [restaurant_price, restaurant_mean_rating, restaurant_num_ratings]
+    >>> pred, r_squared = find_multivariate_predictor(user, cluster, fns, 0)
+    >>> [round(pred(r), 5) for r in cluster], round(r_squared, 5)
+    ([2.5, 4.5, 3.5, 4.0], 1.0)
+    >>> pred, r_squared = find_multivariate_predictor(user, cluster, fns)
+    >>> [round(pred(r), 2) for r in cluster], round(r_squared, 2)
+    ([2.64, 4.4, 3.51, 3.96], 0.99)
+    >>> far = make_restaurant('E', [0, 0], [], 40, [make_review('E', 5)])
+    >>> pred(far)
+    5
+    """
+    ## dictionary of (name: rating) pairs for a SINGLE user
+    reviews_by_user = {review_restaurant_name(review): review_rating(review)
+                       for review in user_reviews(user).values()}
 
-    b = Sxy/ Sxx
-    a = mean(ys) - b * mean(xs)
-    r_squared = pow(Sxy, 2) / (Sxx * Syy)
+    ys = [reviews_by_user[restaurant_name(r)] for r in restaurants]
+    mean_y = mean(ys)
+    dys = [y - mean_y for y in ys]
+    Syy = sum([pow(dy, 2) for dy in dys])
+
+    # Center each feature column and scale it to unit length, so that the
+    # normal equations are well conditioned whatever the units of a feature
+    means, scales, columns = [], [], []
+    for feature_fn in feature_fns:
+        xs = feature_values(feature_fn, restaurants)
+        mean_x = mean(xs)
+        dxs = [x - mean_x for x in xs]
+        scale = sqrt(sum([pow(dx, 2) for dx in dxs])) or 1
+        means.append(mean_x)
+        scales.append(scale)
+        columns.append([dx / scale for dx in dxs])
+
+    gram = [[dot(u, v) for v in columns] for u in columns]
+    for i, column in enumerate(columns):
+        if gram[i][i]: # Constant columns keep a 0 pivot and get weight 0
+            gram[i][i] += ridge
+    moments = [dot(u, dys) for u in columns]
+    weights = solve_normal_equations(gram, moments)
+
+    bs = [w / scale for w, scale in zip(weights, scales)]
+    a = mean_y - dot(bs, means)
+    fitted = [dot(weights, row) for row in zip(*columns)] or [0] * len(ys)
+    error = sum([pow(dy - f, 2) for dy, f in zip(dys, fitted)])
+    r_squared = 1 - error / Syy if Syy else 0
 
     def predictor(restaurant):
-        return b * feature_fn(restaurant) + a
+        xs = [feature_value(fn, restaurant) for fn in feature_fns]
+        return min(5, max(1, a + dot(bs, xs)))
 
     return predictor, r_squared
 
-def best_predictor(user, restaurants, feature_fns):
-    """Find the feature within FEATURE_FNS that gives the highest R^2 value
-    for predicting ratings by the user; return a predictor using that feature.
+def solve_normal_equations(gram, moments, tolerance=1e-10):
+    """Return weights w such that GRAM w = MOMENTS, where GRAM is a symmetric
+    positive semi-definite matrix (a list of rows) whose diagonal entries are
+    1, or 0 for constant columns.
+
+    A column that is (nearly) a linear combination of earlier columns has a
+    pivot below TOLERANCE; it gets weight 0 instead of a huge or infinite one.
+
+    >>> solve_normal_equations([[1, 0.5], [0.5, 1]], [2, 2.5])
+    [1.0, 2.0]
+    >>> solve_normal_equations([[1, 1], [1, 1]], [3, 3])
+    [3.0, 0]
+    """
+    k = len(moments)
+    a = [list(map(float, row)) for row in gram]
+    b = list(map(float, moments))
+    kept = [False] * k
+    for j in range(k):
+        if a[j][j] < tolerance:
+            continue
+        kept[j] = True
+        for i in range(j + 1, k):
+            factor = a[i][j] / a[j][j]
+            for m in range(j, k):
+                a[i][m] -= factor * a[j][m]
+            b[i] -= factor * b[j]
+    weights = [0] * k
+    for j in reversed(range(k)):
+        if kept[j]:
+            rest = sum(a[j][m] * weights[m] for m in range(j + 1, k))
+            weights[j] = (b[j] - rest) / a[j][j]
+    return weights
+
+def multivariate_predictor(user, restaurants, feature_fns):
+    """Return a predictor for the user that uses all of FEATURE_FNS together,
+    or the predictor from best_predictor if the user has too few reviews to
+    fit one weight per feature. Either way, predictions are clamped to 1 to 5.
 
     Arguments:
     user -- A user
     restaurants -- A dictionary from restaurant names to restaurants
     feature_fns -- A sequence of functions that each takes a restaurant
+
+    >>> user = make_user('Newcomer', [make_review('A', 2), make_review('B', 4)])
+    >>> restaurants = {
+    ...     'A': make_restaurant('A', [0, 0], [], 1, [make_review('A', 2)]),
+    ...     'B': make_restaurant('B', [0, 0], [], 3, [make_review('B', 4)]),
+    ...     'C': make_restaurant('C', [0, 0], [], 9, [make_review('C', 1)]),
+    ... }
+    >>> fns = [restaurant_price, restaurant_mean_rating]
+    >>> multivariate_predictor(user, restaurants, fns)(restaurants['C'])
+    5
     """
+    feature_fns = list(feature_fns)
     reviewed = list(user_reviewed_restaurants(user, restaurants).values())
-    func = max(feature_fns, key = lambda x: find_predictor(user, reviewed, x)[1])
-    return find_predictor(user, reviewed, func)[0]
-
-
-def rate_all(user, restaurants, feature_functions):
+    # A fit needs several reviews for each of its weights and its intercept;
+    # with fewer, it matches noise rather than the user's taste.
+    if len(reviewed) < 3 * (len(feature_fns) + 1):
+        fallback = best_predictor(user, restaurants, feature_fns)
+        return lambda restaurant: min(5, max(1, fallback(restaurant)))
+    return find_multivariate_predictor(user, reviewed, feature_fns)[0]
+
+def rate_all(user, restaurants, feature_functions, choose_predictor=None):
     """Return the predicted ratings of RESTAURANTS by A USER using the best
     predictor based a function from FEATURE_FUNCTIONS.
 
     Arguments:
     user -- A user
     restaurants -- A dictionary from restaurant names to restaurants
+    choose_predictor -- A function like best_predictor (the default) that
+                        returns a predictor for a user
     """
+    choose_predictor = choose_predictor or best_predictor
     # Use the best predictor for the user, learned from *all* restaurants
     # (Note: the name RESTAURANTS is bound to a dictionary of all restaurants)
-    predictor = best_predictor(user, RESTAURANTS, feature_functions)
-    reviewed_res = user_reviewed_restaurants(user, restaurants)
-
-    user_r = {}
-
-    for r in restaurants.keys():
-        if r in reviewed_res.keys():
-            new = {r: user_rating(user,r)}
-            user_r.update(new)
-        else:
-            new = {r: predictor(restaurants.get(r))}
-            user_r.update(new)
-    return user_r 
-
-
+    predictor = choose_predictor(user, all_restaurants(), feature_functions)
+    reviewed = user_reviewed_restaurants(user, restaurants)
+    return {name: user_rating(user, name) if name in reviewed else predictor(r)
+            for name, r in restaurants.items()}
 
 def search(query, restaurants):
     """Return each restaurant in RESTAURANTS that has QUERY as a category.
 
+    QUERY may also combine categories with AND, OR and NOT, as in
+    'Thai OR Pizza AND NOT Bars'. To search the same restaurants many times,
+    use index.search_index, which does not scan every restaurant.
+
     Arguments:
     query -- A string
     restaurants -- A sequence of restaurants
     """
-    return [r for r in restaurants if query in restaurant_categories(r)]
+    clauses = parse_query(query)
+    return [r for r in restaurants
+            if query_matches(clauses, restaurant_categories(r))]
+
+def restaurant_latitude(restaurant):
+    return restaurant_location(restaurant)[0]
+
+def restaurant_longitude(restaurant):
+    return restaurant_location(restaurant)[1]
 
 def feature_set():
     """Return a sequence of feature functions."""
+    # Named functions, rather than lambdas, so that cached feature values are
+    # shared between calls.
     return [restaurant_mean_rating,
             restaurant_price,
             restaurant_num_ratings,
-            lambda r: restaurant_location(r)[0],
-            lambda r: restaurant_location(r)[1]]
+            restaurant_latitude,
+            restaurant_longitude]
+
+_indexes = {}
+_indexes_lock = Lock() # Threads of the service may ask for the indexes at once
+
+def restaurant_indexes():
+    """Return a category index and a grid index of all RESTAURANTS, which are
+    built the first time they are needed."""
+    restaurants = all_restaurants()
+    with _indexes_lock:
+        if _indexes.get('restaurants') is not restaurants:
+            _indexes['restaurants'] = restaurants
+            _indexes['category'] = make_category_index(restaurants.values())
+            _indexes['grid'] = make_grid_index(restaurants.values())
+        return _indexes['category'], _indexes['grid']
+
+def filter_restaurants(filters):
+    """Return the restaurants in RESTAURANTS that pass FILTERS, a dictionary
+    that may contain a category 'query', and a location 'near' with a 'radius'
+    in meters (default 500) or a number of 'closest' restaurants. The indexes
+    are used, so restaurants that fail the filters are never visited.
+    """
+    category_index, grid = restaurant_indexes()
+    restaurants = None
+    if filters.get('query'):
+        restaurants = search_index(filters['query'], category_index)
+    if filters.get('near'):
+        if filters.get('closest'):
+            restaurants = nearest(grid, filters['near'], filters['closest'],
+                                  restaurants)
+        else:
+            restaurants = within(grid, filters['near'],
+                                 filters.get('radius', 500), restaurants)
+    if restaurants is None:
+        restaurants = list(all_restaurants().values())
+    return restaurants
+
+def recommend_top(user, n, filters=None, choose_predictor=None):
+    """Return the N restaurants that USER has not reviewed with the highest
+    predicted ratings, as [restaurant, rating] pairs, best first.
+
+    Restaurants are first narrowed down by FILTERS (see filter_restaurants),
+    and only those that remain are rated. Ratings are streamed through a heap
+    that holds at most N of them, so no dictionary of every rating is built.
+
+    Arguments:
+    user -- A user
+    n -- The number of restaurants to return
+    filters -- A dictionary of filters for filter_restaurants
+    choose_predictor -- A function like best_predictor (the default)
+    """
+    choose_predictor = choose_predictor or best_predictor
+    predictor = choose_predictor(user, all_restaurants(), feature_set())
+    reviewed = user_reviews(user)
+    candidates = (r for r in filter_restaurants(filters or {})
+                  if restaurant_name(r) not in reviewed)
+    rated = ([r, predictor(r)] for r in candidates)
+    return nlargest(n, rated, key=lambda pair: pair[1])
+
+PREDICTORS = {
+    'best': best_predictor,
+    'multi': multivariate_predictor,
+    'cv': cross_validated_predictor,
+    'cf': collaborative_predictor,
+}
 
 @main
 def main(*args):
     import argparse
+    with phase('load data'):
+        all_restaurants()
     parser = argparse.ArgumentParser(
         description='Run Recommendations',
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument('-u', '--user', type=str, choices=USER_FILES,
+    parser.add_argument('-u', '--user', type=str, choices=data.USER_FILES,
                         default='test_user',
                         metavar='USER',
                         help='user file, e.g.\n' +
-                        '{{{}}}'.format(','.join(sample(USER_FILES, 3))))
+                        '{{{}}}'.format(','.join(sample(data.USER_FILES, 3))))
     parser.add_argument('-k', '--k', type=int, help='for k-means')
-    parser.add_argument('-q', '--query', choices=CATEGORIES,
-                        metavar='QUERY',
-                        help='search for restaurants by category e.g.\n'
-                        '{{{}}}'.format(','.join(sample(CATEGORIES, 3))))
-    parser.add_argument('-p', '--predict', action='store_true',
-                        help='predict ratings for all restaurants')
+    parser.add_argument('-d', '--dbscan', type=float, metavar='RADIUS',
+                        help='cluster dense groups of restaurants instead of\n'
+                        'using k-means, where each restaurant in a dense\n'
+                        'group has neighbors within RADIUS meters')
+    parser.add_argument('-m', '--min-restaurants', type=int, default=4,
+                        help='for --dbscan, the restaurants within RADIUS\n'
+                        'that make a group dense (default: 4)')
+    parser.add_argument('-q', '--query', metavar='QUERY',
+                        help='search for restaurants by category, combined\n'
+                        'with AND, OR and NOT, e.g.\n'
+                        '"{} OR {} AND NOT {}"'.format(*sample(sorted(data.CATEGORIES), 3)))
+    parser.add_argument('-p', '--predict', nargs='?', const='best',
+                        choices=PREDICTORS, metavar='MODEL',
+                        help='predict ratings for all restaurants, using the\n'
+                        'best single feature (default), all features together,\n'
+                        'the single feature chosen by cross-validation,\n'
+                        'or the ratings of similar users\n'
+                        '{{{}}}'.format(','.join(PREDICTORS)))
+    parser.add_argument('-n', '--near', nargs=2, type=float,
+                        metavar=('LAT', 'LON'),
+                        help='only restaurants near a location, e.g.\n'
+                        '37.8719 -122.2585')
+    parser.add_argument('-r', '--radius', type=float, default=500,
+                        help='for --near, in meters (default: 500)')
+    parser.add_argument('-c', '--closest', type=int, metavar='N',
+                        help='for --near, the N closest restaurants instead\n'
+                        'of those within the radius')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time taken by each phase and the\n'
+                        'number of calls of hot functions')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help='write the same profile to FILE as JSON')
     args = parser.parse_args()
-
-    # Select restaurants using a category query
+    if args.k and args.dbscan:
+        parser.error('choose either --k or --dbscan')
+    if args.dbscan is not None and not args.dbscan > 0:
+        parser.error('--dbscan RADIUS must be positive')
+    profiling = args.profile or args.profile_json
+    if profiling:
+        import visualize.voronoi
+        for name in ['distance', 'find_closest']:
+            count_calls(globals(), name)
+        count_calls(vars(visualize.voronoi), 'distance')
     if args.query:
-        results = search(args.query, RESTAURANTS.values())
-        restaurants = {restaurant_name(r): r for r in results}
-    else:
-        restaurants = RESTAURANTS
+        try:
+            unknown = query_categories(parse_query(args.query)) - data.CATEGORIES
+        except ValueError as e:
+            parser.error(e)
+        if unknown:
+            parser.error('unknown categories: ' + ', '.join(sorted(unknown)))
+
+    # Select restaurants using a category query and a location
+    with phase('search'):
+        if args.query or args.near:
+            results = filter_restaurants({'query': args.query, 'near': args.near,
+                                          'radius': args.radius,
+                                          'closest': args.closest})
+            restaurants = {restaurant_name(r): r for r in results}
+        else:
+            restaurants = all_restaurants()
 
     # Load a user
     assert args.user, 'A --user is required to draw a map'
-    user = load_user_file('{}.dat'.format(args.user))
+    with phase('load user'):
+        user = load_user_file('{}.dat'.format(args.user))
 
     # Collect ratings
-    if args.predict:
-        ratings = rate_all(user, restaurants, feature_set())
-    else:
-        restaurants = user_reviewed_restaurants(user, restaurants)
-        ratings = {name: user_rating(user, name) for name in restaurants}
+    with phase('predict'):
+        if args.predict:
+            ratings = rate_all(user, restaurants, feature_set(),
+                               PREDICTORS[args.predict])
+        else:
+            restaurants = user_reviewed_restaurants(user, restaurants)
+            ratings = {name: user_rating(user, name) for name in restaurants}
 
     # Draw the visualization
     restaurant_list = list(restaurants.values())
+    clusters = None
     if args.k:
-        centroids = k_means(restaurant_list, min(args.k, len(restaurant_list)))
+        with phase('k-means'):
+            centroids = k_means(restaurant_list, min(args.k, len(restaurant_list)))
+    elif args.dbscan:
+        with phase('dbscan'):
+            clusters = dbscan(restaurant_list, args.dbscan, args.min_restaurants)
+            centroids = [find_centroid(c) for c in clusters]
     else:
         centroids = [restaurant_location(r) for r in restaurant_list]
-    draw_map(centroids, restaurant_list, ratings)
+    with phase('visualize'):
+        write_map(centroids, restaurant_list, ratings, 'visualize/voronoi.json',
+                  clusters)
+    if args.profile:
+        print('\n'.join(profile_report()))
+    if args.profile_json:
+        save_profile(args.profile_json)
+    load_visualization('voronoi.html')
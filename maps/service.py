@@ -0,0 +1,284 @@
+"""A local HTTP service that answers recommendation queries as JSON
+
+The data is loaded once and kept in memory, and the most recently used user
+predictors and clustering results are kept in LRU caches, so repeated queries
+are answered without refitting anything. Queries are answered concurrently,
+each in its own thread. The caches are locked while they are read or changed,
+and the state shared by the modules that answer queries (the feature cache,
+the restaurant indexes and the rating matrix) is locked where it is built.
+Every query is a GET request:
+
+    /search?q=QUERY&near=LAT,LON&radius=METERS&closest=N
+    /predict?user=USER&restaurant=NAME&model=MODEL
+    /top?user=USER&n=N&model=MODEL&q=...&near=...
+    /kmeans?k=K&q=...&near=...
+
+For example, with the service running on the default port,
+
+    curl 'localhost:8001/top?user=one_cluster&n=5&q=Pizza'
+"""
+
+import json
+import threading
+from math import isfinite
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from abstractions import *
+from recommend import PREDICTORS, feature_set, filter_restaurants
+from recommend import recommend_top, k_means, group_by_centroid
+from data import RESTAURANTS, CATEGORIES, USER_FILES, load_user_file
+from index import parse_query, query_categories
+from ucb import main
+
+# LRU caches
+
+def make_cache(capacity):
+    """Return an empty cache that holds at most CAPACITY values."""
+    return [OrderedDict(), capacity, [0, 0], threading.Lock()]
+
+def cache_lookup(cache, key, compute):
+    """Return the value for KEY in CACHE, calling COMPUTE() to find it if it is
+    not there. The least recently used value is dropped when CACHE is full.
+
+    CACHE is locked only while it is read or changed, not while COMPUTE runs,
+    so threads that compute different values do not wait for each other. Two
+    threads that miss the same KEY at once both compute its value.
+
+    >>> cache = make_cache(2)
+    >>> for key in ['a', 'b', 'a', 'c', 'b']:
+    ...     _ = cache_lookup(cache, key, lambda: print('computing', key))
+    computing a
+    computing b
+    computing c
+    computing b
+    >>> cache_stats(cache)
+    {'size': 2, 'capacity': 2, 'hits': 1, 'misses': 4}
+    """
+    values, capacity, counts, lock = cache
+    with lock:
+        if key in values:
+            values.move_to_end(key)
+            counts[0] += 1
+            return values[key]
+        counts[1] += 1
+    value = compute()
+    with lock:
+        values[key] = value
+        if len(values) > capacity:
+            values.popitem(last=False)
+    return value
+
+def cache_stats(cache):
+    values, capacity, (hits, misses), lock = cache
+    with lock:
+        return {'size': len(values), 'capacity': capacity,
+                'hits': hits, 'misses': misses}
+
+# Queries
+
+class QueryError(ValueError):
+    """A query that cannot be answered; its message is sent to the client."""
+
+def make_service(capacity=64):
+    """Return the state of a service whose caches hold CAPACITY values each."""
+    return {'users': make_cache(capacity), 'predictors': make_cache(capacity),
+            'clusters': make_cache(capacity)}
+
+def get_user(service, params):
+    name = param(params, 'user')
+    if name not in USER_FILES:
+        raise QueryError('unknown user: ' + name)
+    return cache_lookup(service['users'], name,
+                        lambda: load_user_file('{}.dat'.format(name)))
+
+def get_predictor(service, params):
+    """Return the predictor of the user in PARAMS for the model in PARAMS,
+    fitting it only if it is not cached. Predictors are cached by the name of
+    the user file, since different files may hold users with the same name."""
+    user = get_user(service, params)
+    model = param(params, 'model', 'best')
+    if model not in PREDICTORS:
+        raise QueryError('unknown model: ' + model)
+    def fit():
+        try:
+            return PREDICTORS[model](user, RESTAURANTS, feature_set())
+        except ZeroDivisionError:
+            raise QueryError('too few distinct ratings to fit a predictor')
+    key = (param(params, 'user'), model)
+    return user, cache_lookup(service['predictors'], key, fit)
+
+def get_filters(params):
+    """Return the filters for filter_restaurants given by PARAMS."""
+    filters = {}
+    query = param(params, 'q', '')
+    if query:
+        try:
+            unknown = query_categories(parse_query(query)) - CATEGORIES
+        except ValueError as e:
+            raise QueryError(str(e))
+        if unknown:
+            raise QueryError('unknown categories: ' + ', '.join(sorted(unknown)))
+        filters['query'] = query
+    near = param(params, 'near', '')
+    if near:
+        try:
+            lat, lon = [float(x) for x in near.split(',')]
+        except ValueError:
+            raise QueryError('near must be LAT,LON')
+        if not (isfinite(lat) and isfinite(lon)):
+            raise QueryError('near must be a finite LAT,LON')
+        filters['near'] = [lat, lon]
+        filters['radius'] = number_param(params, 'radius', 500, float)
+        filters['closest'] = number_param(params, 'closest', None)
+    return filters
+
+def param(params, name, default=None):
+    """Return the value of query parameter NAME in PARAMS."""
+    if name in params:
+        return params[name][-1]
+    if default is None:
+        raise QueryError('missing parameter: ' + name)
+    return default
+
+def number_param(params, name, default, kind=int):
+    if name not in params:
+        return default
+    try:
+        value = kind(params[name][-1])
+    except ValueError:
+        raise QueryError('{} must be a number'.format(name))
+    if not isfinite(value):
+        raise QueryError('{} must be a finite number'.format(name))
+    return value
+
+def restaurant_json(restaurant):
+    return {'name': restaurant_name(restaurant),
+            'location': restaurant_location(restaurant),
+            'categories': restaurant_categories(restaurant),
+            'price': restaurant_price(restaurant)}
+
+def answer_search(service, params):
+    restaurants = filter_restaurants(get_filters(params))
+    return [restaurant_json(r) for r in restaurants]
+
+def answer_predict(service, params):
+    name = param(params, 'restaurant')
+    if name not in RESTAURANTS:
+        raise QueryError('unknown restaurant: ' + name)
+    user, predictor = get_predictor(service, params)
+    if name in user_reviews(user):
+        return {'rating': user_rating(user, name), 'reviewed': True}
+    return {'rating': predictor(RESTAURANTS[name]), 'reviewed': False}
+
+def answer_top(service, params):
+    user, predictor = get_predictor(service, params)
+    n = number_param(params, 'n', 10)
+    top = recommend_top(user, n, get_filters(params), lambda *_: predictor)
+    return [dict(restaurant_json(r), rating=rating) for r, rating in top]
+
+def answer_kmeans(service, params):
+    """Return the centroids of K clusters of the filtered restaurants and the
+    cluster of each restaurant. Results are cached, so the same query always
+    gets the same clusters while it stays in the cache."""
+    k = number_param(params, 'k', 5)
+    filters = get_filters(params)
+    def cluster():
+        restaurants = filter_restaurants(filters)
+        if not 0 < k <= len(restaurants):
+            raise QueryError('k must be between 1 and the number of restaurants')
+        centroids = k_means(restaurants, k)
+        groups = group_by_centroid(restaurants, centroids)
+        return {'centroids': centroids,
+                'clusters': [[restaurant_name(r) for r in group]
+                             for group in groups]}
+    key = (k, json.dumps(filters, sort_keys=True))
+    return cache_lookup(service['clusters'], key, cluster)
+
+def answer_stats(service, params):
+    return {name: cache_stats(service[name])
+            for name in ('users', 'predictors', 'clusters')}
+
+ANSWERS = {
+    '/search': answer_search,
+    '/predict': answer_predict,
+    '/top': answer_top,
+    '/kmeans': answer_kmeans,
+    '/stats': answer_stats,
+}
+
+def respond(service, url):
+    """Return [status, result] for a request of URL, where a result is a value
+    that can be written as JSON. A query that cannot be answered gets status
+    400, and any other error while answering gets status 500.
+
+    >>> service = make_service()
+    >>> respond(service, '/nowhere')
+    [404, {'error': 'unknown path: /nowhere'}]
+    >>> respond(service, '/predict?user=test_user')
+    [400, {'error': 'missing parameter: restaurant'}]
+    >>> respond(service, '/search?near=nan,nan')
+    [400, {'error': 'near must be a finite LAT,LON'}]
+    >>> ANSWERS['/broken'] = lambda service, params: 1 / 0
+    >>> respond(service, '/broken')
+    [500, {'error': 'ZeroDivisionError: division by zero'}]
+    >>> del ANSWERS['/broken']
+    """
+    parts = urlsplit(url)
+    answer = ANSWERS.get(parts.path)
+    if answer is None:
+        return [404, {'error': 'unknown path: ' + parts.path}]
+    params = parse_qs(parts.query)
+    try:
+        return [200, answer(service, params)]
+    except QueryError as e:
+        return [400, {'error': str(e)}]
+    except Exception as e:
+        return [500, {'error': '{}: {}'.format(type(e).__name__, e)}]
+
+# HTTP
+
+def make_handler(service):
+    """Return a request handler class that answers requests using SERVICE."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, result = respond(service, self.path)
+            body = json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+    return Handler
+
+def make_server(service, host='127.0.0.1', port=8001):
+    """Return an HTTP server for SERVICE; call its serve_forever method to
+    start answering requests. Port 0 picks any free port."""
+    return ThreadingHTTPServer((host, port), make_handler(service))
+
+@main
+def run(*args):
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve recommendations as JSON')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8001,
+                        help='port to listen on (default: 8001)')
+    parser.add_argument('-c', '--cache', type=int, default=64,
+                        help='size of each LRU cache (default: 64)')
+    args = parser.parse_args()
+
+    len(RESTAURANTS) # Load the data before the first request
+    httpd = make_server(make_service(args.cache), args.host, args.port)
+    print('Serving recommendations on', args.host, 'port', args.port, '...')
+    print('Type Ctrl-C to exit.')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print('\nKeyboard interrupt received, exiting.')
+    finally:
+        httpd.server_close()
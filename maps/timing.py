@@ -0,0 +1,85 @@
+"""Timing the phases of a program run
+
+Wall time is collected for named phases, calls are counted for functions
+wrapped with count_calls, and other numbers are kept with record. All three
+are reported together by profile_report or saved as JSON by save_profile.
+
+>>> with phase('example'):
+...     pass
+>>> phase_times()['example'] >= 0
+True
+"""
+
+import json
+from contextlib import contextmanager
+from time import perf_counter
+
+_phases = {}
+_calls = {}
+_values = {}
+
+@contextmanager
+def phase(name):
+    """Add the wall time spent in a with statement to phase NAME."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = _phases.get(name, 0) + perf_counter() - start
+
+def phase_times():
+    return dict(_phases)
+
+def count_calls(namespace, name, label=None):
+    """Replace function NAME in NAMESPACE (a dictionary of globals) with one
+    that counts its calls under LABEL (default: NAME). Functions that look up
+    NAME in NAMESPACE call the replacement from then on.
+
+    >>> namespace = {'double': lambda x: 2 * x}
+    >>> count_calls(namespace, 'double')
+    >>> [namespace['double'](x) for x in range(3)]
+    [0, 2, 4]
+    >>> call_counts()['double']
+    3
+    """
+    fn = namespace[name]
+    label = label or name
+    _calls.setdefault(label, 0)
+    def counted(*args, **kwargs):
+        _calls[label] += 1
+        return fn(*args, **kwargs)
+    counted.__name__ = getattr(fn, '__name__', name)
+    counted.__doc__ = fn.__doc__
+    namespace[name] = counted
+
+def call_counts():
+    return dict(_calls)
+
+def record(name, value):
+    """Keep VALUE under NAME, replacing any earlier value."""
+    _values[name] = value
+
+def profile():
+    """Return the collected phase times, call counts and values."""
+    return {'phases': phase_times(), 'calls': call_counts(),
+            'values': dict(_values)}
+
+def profile_report():
+    """Return the collected profile as lines of text."""
+    phases = phase_times()
+    total = sum(phases.values())
+    lines = ['{:24}{:>10}{:>8}'.format('phase', 'seconds', '%')]
+    for name, seconds in phases.items():
+        share = 100 * seconds / total if total else 0
+        lines.append('{:24}{:>10.4f}{:>8.1f}'.format(name, seconds, share))
+    lines.append('{:24}{:>10.4f}'.format('total', total))
+    for name, count in call_counts().items():
+        lines.append('{:24}{:>10}'.format(name + ' calls', count))
+    for name, value in _values.items():
+        lines.append('{:24}{:>10}'.format(name, value))
+    return lines
+
+def save_profile(path):
+    """Write the collected profile to PATH as JSON."""
+    with open(path, 'w') as f:
+        json.dump(profile(), f, indent=2)
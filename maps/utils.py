@@ -67,6 +67,14 @@ def distance(pos1, pos2):
     """
     return sqrt((pos1[0] - pos2[0]) ** 2 + (pos1[1] - pos2[1]) ** 2)
 
+def dot(xs, ys):
+    """Return the dot product of two sequences of numbers XS and YS.
+
+    >>> dot([1, 2, 3], [4, 5, 6])
+    32
+    """
+    return sum([x * y for x, y in _zip(xs, ys)])
+
 def mean(lst):
     """Return the arithmetic mean of a sequence of numbers.
 
@@ -1,38 +1,85 @@
+import gzip
 import http.server
 import json
+import os
 import webbrowser
-from utils import distance
 
 from abstractions import *
+from visualize.voronoi import make_point_grid, closest_positions, voronoi_cells
 
-def draw_map(centroids, restaurants, ratings):
+# The area shown on the map, as [west, east] longitudes and [north, south]
+# latitudes, and the size of the drawing in pixels
+LONGITUDES = [-122.272, -122.248]
+LATITUDES = [37.88, 37.86]
+WIDTH, HEIGHT = 580, 580
+
+def draw_map(centroids, restaurants, ratings, clusters=None):
     """Write a JSON file containing inputs and load a visualization.
 
     Arguments:
     centroids -- A sequence of positions
     restaurants -- A sequence of restaurants
     ratings -- A dictionary from restaurant names to ratings
+    clusters -- A list of lists of restaurants, one for each centroid; by
+                default each restaurant is in the cluster of the closest
+                centroid
     """
-    data = []
-    locations = set()
-    for restaurant in restaurants:
-        p = tuple(restaurant_location(restaurant))
-        cluster = min(enumerate(centroids), key=lambda v: distance(p, v[1]))[0]
-        name = restaurant_name(restaurant)
-        rating = ratings[name]
-        if p not in locations:
-            data.append({
-                'x': p[0],
-                'y': p[1],
-                'weight': rating,
-                'name': name,
-                'cluster': cluster,
-            })
-            locations.add(p)
-    with open('visualize/voronoi.json', 'w') as f:
-        json.dump(data, f)
+    write_map(centroids, restaurants, ratings, 'visualize/voronoi.json',
+              clusters)
     load_visualization('voronoi.html')
 
+def write_map(centroids, restaurants, ratings, path, clusters=None):
+    """Write the data drawn by voronoi.js for draw_map to PATH."""
+    names, locations, weights, kept = [], [], [], []
+    seen = set()
+    for restaurant in restaurants:
+        p = restaurant_location(restaurant)
+        if tuple(p) not in seen:
+            seen.add(tuple(p))
+            names.append(restaurant_name(restaurant))
+            locations.append(p)
+            weights.append(ratings[names[-1]])
+            kept.append(restaurant)
+    if clusters is None:
+        clusters = closest_positions(make_point_grid(list(centroids)), locations)
+    else:
+        cluster_of = {r: i for i, c in enumerate(clusters) for r in c}
+        clusters = [cluster_of[r] for r in kept]
+    write_payload(map_payload(names, locations, weights, clusters), path)
+
+def to_pixels(location):
+    """Return the position [x, y] in pixels of LOCATION on the drawing."""
+    lat, lon = location
+    (west, east), (north, south) = LONGITUDES, LATITUDES
+    return [(lon - west) / (east - west) * WIDTH,
+            (lat - north) / (south - north) * HEIGHT]
+
+def map_payload(names, locations, weights, clusters):
+    """Return the data drawn by voronoi.js: the name, position, weight and
+    cluster of each place, and its Voronoi cell within the drawing. Positions
+    and cells are in pixels, rounded to a tenth, and each cell is a flat list
+    of corner coordinates [x0, y0, x1, y1, ...]."""
+    points = [to_pixels(location) for location in locations]
+    cells = voronoi_cells(points, WIDTH, HEIGHT)
+    return {
+        'size': [WIDTH, HEIGHT],
+        'names': names,
+        'points': [[round(x, 1), round(y, 1)] for x, y in points],
+        'weights': [round(w, 2) for w in weights],
+        'clusters': clusters,
+        'cells': [[round(v, 1) for corner in cell for v in corner]
+                  for cell in cells],
+    }
+
+def write_payload(payload, path):
+    """Write PAYLOAD as compact JSON to PATH, and a gzipped copy to PATH.gz
+    that the server sends to browsers that accept it."""
+    text = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(text)
+    with gzip.open(path + '.gz', 'wb') as f:
+        f.write(text)
+
 def load_visualization(url, base_url='http://localhost:8000/visualize/'):
     """Load the visualization located at URL."""
     server = start_threaded_server()
@@ -43,6 +90,23 @@ def load_visualization(url, base_url='http://localhost:8000/visualize/'):
         print('\nKeyboard interrupt received, exiting.')
 
 class SilentServer(http.server.SimpleHTTPRequestHandler):
+    def send_head(self):
+        """Send a gzipped copy of a JSON file instead, if there is one and the
+        browser accepts it."""
+        path = self.translate_path(self.path)
+        accepts = self.headers.get('Accept-Encoding', '')
+        if (path.endswith('.json') and 'gzip' in accepts and
+                os.path.isfile(path + '.gz') and
+                os.path.getmtime(path + '.gz') >= os.path.getmtime(path)):
+            f = open(path + '.gz', 'rb')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            return f
+        return super().send_head()
+
     def log_message(self, format, *args):
         return
 
@@ -4,11 +4,6 @@ var margins = {top: 0, right: 0, bottom: 0, left: 0},
     height = 580 - margins.top - margins.bottom,
     width =  580 - margins.left - margins.right;
 
-var x = d3.scale.linear().range([0, width]);
-var y = d3.scale.linear().range([0, height]);
-var xAxis = d3.svg.axis().scale(x).orient("bottom");
-var yAxis = d3.svg.axis().scale(y).orient("left");
-
 var clusterColor = d3.scale.category10();
 var fillColor = d3.scale.linear().domain([1, 5]).range(["blue", "yellow"]);
 var fillOpacity = 0.3;
@@ -40,18 +35,27 @@ var resetColor = function(d, i) {
         .style("fill", function (d) { return fillColor(d.weight); });
 };
 
-d3.json("voronoi.json", function(data) {
-    // extents of Berkeley restaurants
-    x.domain([-122.272, -122.248]).nice();
-    y.domain([37.88, 37.86]).nice();
-
-    var voronoi = d3.geom.voronoi().clipExtent([[0, 0], [width, height]]);
-    var polygons = voronoi(data.map(function (d) { return [x(d.y), y(d.x), d.weight]; }))
-            .map(d3.geom.polygon);
-    polygons.forEach(function (val, i, arr) {
-        val.weight = data[i].weight;
-        val.name = data[i].name;
-        val.cluster = data[i].cluster;
+d3.json("voronoi.json", function(payload) {
+    // Positions and Voronoi cells are computed in pixels by draw_map
+    var data = payload.names.map(function (name, i) {
+        return {
+            name: name,
+            weight: payload.weights[i],
+            cluster: payload.clusters[i],
+            point: payload.points[i]
+        };
+    });
+    var polygons = [];
+    payload.cells.forEach(function (cell, i) {
+        if (cell.length === 0) { return; }
+        var polygon = [];
+        for (var k = 0; k < cell.length; k += 2) {
+            polygon.push([cell[k], cell[k + 1]]);
+        }
+        polygon.weight = data[i].weight;
+        polygon.name = data[i].name;
+        polygon.cluster = data[i].cluster;
+        polygons.push(polygon);
     });
 
     svg.selectAll("path")
@@ -88,8 +92,8 @@ d3.json("voronoi.json", function(data) {
         .append("circle")
         .attr("class", "dot")
         .attr("r", function (d) { return 4; })
-        .attr("cx", function(d) { return x(d.y); })
-        .attr("cy", function(d) { return y(d.x); })
+        .attr("cx", function(d) { return d.point[0]; })
+        .attr("cy", function(d) { return d.point[1]; })
         .style("fill", function(d) { return clusterColor(d.cluster); })
         .on("mouseover", function(d) {
             tooltip.transition()
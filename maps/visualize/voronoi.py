@@ -0,0 +1,119 @@
+"""Voronoi cells and nearest-point lookups for the map visualization
+
+Points are looked up through a uniform grid of square cells. The Voronoi cell
+of a site is found by cutting the drawing area with the perpendicular bisector
+between the site and each of its neighbors, closest first. A neighbor farther
+than twice the distance from the site to any corner of the cell cut so far
+cannot cut it further, so only a few neighbors are visited for each site and
+all cells take about linear time for evenly spread points.
+"""
+
+from math import floor, sqrt
+
+from utils import distance
+
+# Point grids
+
+def make_point_grid(points, cells=1):
+    """Return a grid of POINTS (a list of [x, y] pairs), with about CELLS
+    points in each grid cell on average. The grid holds the points, a
+    dictionary from each non-empty cell (column, row) to the positions of its
+    points, the size of a cell, and the smallest and largest column and row."""
+    if not points:
+        return [points, {}, 1, [0, -1, 0, -1]]
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    area = (max(xs) - min(xs)) * (max(ys) - min(ys))
+    size = sqrt(area * cells / len(points)) or max(max(xs) - min(xs),
+                                                   max(ys) - min(ys)) or 1
+    grid = {}
+    for i, (x, y) in enumerate(points):
+        grid.setdefault((floor(x / size), floor(y / size)), []).append(i)
+    columns = [cell[0] for cell in grid]
+    rows = [cell[1] for cell in grid]
+    bounds = [min(columns), max(columns), min(rows), max(rows)]
+    return [points, grid, size, bounds]
+
+def rings(grid, point):
+    """Yield [ring, positions] for each ring of grid cells around POINT, from
+    the cell that holds POINT outwards, where positions lists the points in
+    the ring. Points beyond ring r are at least r * size away from POINT."""
+    _, cells, size, (left, right, bottom, top) = grid
+    cx, cy = floor(point[0] / size), floor(point[1] / size)
+    # Rings closer than the nearest non-empty cell are empty, so they are
+    # skipped; rings beyond the farthest one are never reached.
+    first = max(left - cx, cx - right, bottom - cy, cy - top, 0)
+    last = max(right - cx, cx - left, top - cy, cy - bottom)
+    for ring in range(first, last + 1):
+        positions = []
+        for dx in range(-ring, ring + 1):
+            step = 1 if abs(dx) == ring else 2 * ring or 1
+            for dy in range(-ring, ring + 1, step):
+                positions.extend(cells.get((cx + dx, cy + dy), ()))
+        yield [ring, positions]
+
+def closest_positions(grid, locations):
+    """Return the position of the point in GRID closest to each of LOCATIONS.
+    Ties go to the earlier point, as with min.
+
+    >>> grid = make_point_grid([[0, 0], [2, 3], [4, 3], [5, 5]])
+    >>> closest_positions(grid, [[3, 4], [9, 9], [-1, 0]])
+    [1, 3, 0]
+    """
+    points, _, size, _ = grid
+    found = []
+    for location in locations:
+        best = None
+        for ring, positions in rings(grid, location):
+            for i in positions:
+                d = distance(location, points[i])
+                if best is None or [d, i] < best:
+                    best = [d, i]
+            if best is not None and best[0] < ring * size:
+                break
+        found.append(best[1])
+    return found
+
+# Voronoi cells
+
+def voronoi_cells(sites, width, height):
+    """Return the Voronoi cell of each of SITES within the rectangle from
+    [0, 0] to [WIDTH, HEIGHT], as a list of its corners. The cell of a site
+    outside the rectangle may be empty.
+
+    >>> voronoi_cells([[1, 1], [3, 1]], 4, 2)
+    [[[0, 0], [2.0, 0.0], [2.0, 2.0], [0, 2]], [[2.0, 0.0], [4, 0], [4, 2], [2.0, 2.0]]]
+    """
+    grid = make_point_grid(sites, cells=2)
+    size = grid[2]
+    box = [[0, 0], [width, 0], [width, height], [0, height]]
+    cells = []
+    for i, site in enumerate(sites):
+        cell = box
+        for ring, positions in rings(grid, site):
+            for j in positions:
+                if j != i and sites[j] != site:
+                    cell = clip(cell, site, sites[j])
+            reach = max([distance(site, corner) for corner in cell], default=0)
+            if ring * size >= 2 * reach:
+                break
+        cells.append(cell)
+    return cells
+
+def clip(polygon, site, other):
+    """Return the part of convex POLYGON that is at least as close to SITE as
+    to OTHER."""
+    # A point p is kept when (other - site) . p <= limit
+    nx, ny = other[0] - site[0], other[1] - site[1]
+    limit = (other[0] ** 2 + other[1] ** 2 - site[0] ** 2 - site[1] ** 2) / 2
+    kept = []
+    for k, p in enumerate(polygon):
+        q = polygon[k - 1]
+        p_side = nx * p[0] + ny * p[1] - limit
+        q_side = nx * q[0] + ny * q[1] - limit
+        if (p_side <= 0) != (q_side <= 0):
+            t = q_side / (q_side - p_side)
+            kept.append([q[0] + t * (p[0] - q[0]), q[1] + t * (p[1] - q[1])])
+        if p_side <= 0:
+            kept.append(p)
+    return kept
@@ -98,7 +98,7 @@ class Frame:
 
     def __init__(self, parent):
         """An empty frame with a PARENT frame (which may be None)."""
-        self.bindings = {}
+        self.bindings = GlobalBindings() if parent is None else {}
         self.parent = parent
 
     def __repr__(self):
@@ -140,9 +140,104 @@ class Frame:
         """Define Scheme SYMBOL to have VALUE."""
         self.bindings[symbol] = value
 
+# The value of a name in a LocalFrame or Cell before it is defined
+unassigned = object()
+
+class Cell:
+    """A box that holds the current VALUE of a global name."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+class GlobalBindings(dict):
+    """The bindings of a global frame. Compiled code keeps the Cell of each
+    global name it refers to, and binding a name updates its cell, so that
+    code sees redefinitions without looking the name up again.
+
+    >>> bindings = GlobalBindings()
+    >>> cell = bindings.cell('x')
+    >>> cell.value is unassigned
+    True
+    >>> bindings['x'] = 1
+    >>> cell.value
+    1
+    """
+    __slots__ = ('cells',)
+
+    def __init__(self):
+        super().__init__()
+        self.cells = {}
+
+    def __setitem__(self, symbol, value):
+        dict.__setitem__(self, symbol, value)
+        if symbol in self.cells:
+            self.cells[symbol].value = value
+
+    def __delitem__(self, symbol):
+        dict.__delitem__(self, symbol)
+        if symbol in self.cells:
+            self.cells[symbol].value = unassigned
+
+    def cell(self, symbol):
+        """Return the Cell of SYMBOL, which is unassigned if it is unbound."""
+        if symbol not in self.cells:
+            self.cells[symbol] = Cell(self.get(symbol, unassigned))
+        return self.cells[symbol]
+
+class LocalFrame:
+    """A frame made by compiled code, which holds the values of a Python list
+    of NAMES in a Python list of VALUES. Compiled code finds a value by its
+    index rather than by name.
+
+    >>> env = LocalFrame(['a', 'b'], [1, unassigned], create_global_frame())
+    >>> env.define('c', 3)
+    >>> env
+    <{a: 1, c: 3} -> <Global Frame>>
+    >>> env.lookup('c')
+    3
+    """
+    __slots__ = ('names', 'values', 'parent')
+
+    def __init__(self, names, values, parent):
+        self.names = names
+        self.values = values
+        self.parent = parent
+
+    @property
+    def bindings(self):
+        return {name: value for name, value in zip(self.names, self.values)
+                if value is not unassigned}
+
+    __repr__ = Frame.__repr__
+    make_child_frame = Frame.make_child_frame
+
+    def lookup(self, symbol):
+        if symbol in self.names:
+            value = self.values[self.names.index(symbol)]
+            if value is not unassigned:
+                return value
+        return self.parent.lookup(symbol)
+
+    def define(self, symbol, value):
+        if symbol in self.names:
+            self.values[self.names.index(symbol)] = value
+        else:
+            # NAMES is shared by all frames of the same compiled body, so a
+            # name it lacks, such as one defined through eval, is added to a
+            # copy
+            self.names = self.names + [symbol]
+            self.values.append(value)
+
 class UserDefinedProcedure:
     """A procedure defined by an expression."""
 
+    # [code, names, arity] for the compiled body, set when the procedure is
+    # made by compiled code or first called by it
+    compiled = None
+    # The same for the bytecode of the body, run by scheme_vm
+    bytecode = None
+
 class LambdaProcedure(UserDefinedProcedure):
     """A procedure defined by a lambda expression or a define form."""
 
@@ -397,6 +492,468 @@ def scheme_optimized_eval(expr, env, tail=False):
 scheme_eval = scheme_optimized_eval
 
 
+###############
+# Compilation #
+###############
+
+# Each expression is compiled once into a Python function of an environment
+# that evaluates it, so its Pair structure and special form are only inspected
+# by the compiler. A call in tail position returns a TailCall instead of
+# making the call, and the nearest call that is not in tail position makes it,
+# so tail calls do not grow the Python stack.
+#
+# Calls and let forms make LocalFrames. The compiler keeps a scope, a tuple of
+# [names, bound] for each enclosing LocalFrame, innermost first, where names
+# lists the names of the frame and the first bound of them are always
+# assigned. A reference to a name in scope becomes its depth in the frame
+# chain and index in the values of that frame. Other names are free: they are
+# found in the frame in which the outermost compiled expression is evaluated,
+# usually the global frame, where each reference keeps the Cell of its name.
+# A frame given a name at run time, by eval, gets its own copy of names;
+# references that pass through such a frame look up their name from there.
+
+class TailCall:
+    """A call of PROCEDURE on a Python list of ARGS from environment ENV."""
+    __slots__ = ('procedure', 'args', 'env')
+
+    def __init__(self, procedure, args, env):
+        self.procedure = procedure
+        self.args = args
+        self.env = env
+
+def scheme_compile(expr, scope=(), tail=False):
+    """Return a function that evaluates Scheme expression EXPR in an
+    environment whose LocalFrames are described by SCOPE. If TAIL, the
+    function may return a TailCall.
+
+    Errors in the form of EXPR are raised when the function is called, just
+    as they would be when evaluating EXPR.
+
+    >>> code = scheme_compile(read_line("(* 2 (+ 1 2))"))
+    >>> code(create_global_frame())
+    6
+    """
+    try:
+        return compile_expression(expr, scope, tail)
+    except SchemeError as err:
+        return compile_error(err)
+
+def compile_error(err):
+    """Return a function that raises ERR when it is called."""
+    def fail(env):
+        raise err
+    return fail
+
+def compile_expression(expr, scope, tail):
+    # Atoms
+    assert expr is not None
+    if scheme_symbolp(expr):
+        return compile_symbol(expr, scope)
+    elif self_evaluating(expr):
+        return lambda env: expr
+
+    # Combinations
+    if not scheme_listp(expr):
+        raise SchemeError("malformed list: {0}".format(str(expr)))
+    first, rest = expr.first, expr.second
+    if scheme_symbolp(first) and first in COMPILERS:
+        return COMPILERS[first](rest, scope, tail)
+    return compile_call(first, rest, scope, tail)
+
+# Variables
+
+def compile_symbol(symbol, scope):
+    for depth, (names, bound) in enumerate(scope):
+        if symbol in names:
+            return compile_local(symbol, scope[:depth], names.index(symbol),
+                                 bound)
+    return compile_free(symbol, scope)
+
+def compile_local(symbol, inner, index, bound):
+    """Return a function that finds local variable SYMBOL at INDEX in the
+    frame after those described by scope INNER. A name defined in the body of
+    its frame (INDEX >= BOUND) may not be defined yet, in which case it is
+    looked up in the parent frames."""
+    inner = [names for names, _ in inner]
+    if not inner and index < bound:
+        return lambda env: env.values[index]
+    def local(env):
+        for names in inner:
+            if env.names is not names:
+                return env.lookup(symbol)
+            env = env.parent
+        value = env.values[index]
+        if value is unassigned:
+            return env.parent.lookup(symbol)
+        return value
+    return local
+
+def compile_free(symbol, scope):
+    """Return a function that looks up SYMBOL by name in the frame after those
+    described by SCOPE. When that is a global frame, the function keeps the
+    Cell of SYMBOL and reads its value directly until it is given a different
+    global frame."""
+    scope = [names for names, _ in scope]
+    cached_env = cell = None
+    def free(env):
+        nonlocal cached_env, cell
+        for names in scope:
+            if env.names is not names:
+                return env.lookup(symbol)
+            env = env.parent
+        if env is not cached_env:
+            if env.parent is not None or type(env.bindings) is not GlobalBindings:
+                return env.lookup(symbol)
+            cached_env, cell = env, env.bindings.cell(symbol)
+        value = cell.value
+        if value is unassigned:
+            return env.lookup(symbol)
+        return value
+    return free
+
+def compile_store(symbol, scope):
+    """Return a function of an environment and a value that defines SYMBOL to
+    have that value in the first frame of the environment."""
+    if scope and symbol in scope[0][0]:
+        index = scope[0][0].index(symbol)
+        def store(env, value):
+            env.values[index] = value
+    else:
+        def store(env, value):
+            env.define(symbol, value)
+    return store
+
+def defined_names(expr, names):
+    """Append to Python list NAMES each name that evaluating EXPR may define
+    in the frame that evaluates it, which excludes definitions in the bodies
+    of lambda, mu and let forms.
+
+    >>> names = ['x']
+    >>> defined_names(read_line("(if x (define y (define z 1)) (lambda () (define w 2)))"), names)
+    >>> names
+    ['x', 'y', 'z']
+    """
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return
+    first, rest = expr.first, expr.second
+    if scheme_symbolp(first) and first in ("quote", "lambda", "mu"):
+        return
+    if first == "define" and rest is not nil:
+        target = rest.first
+        if isinstance(target, Pair):
+            target, expressions = target.first, nil
+        else:
+            expressions = rest.second
+        if scheme_symbolp(target) and target not in names:
+            names.append(target)
+    elif first == "let" and rest is not nil:
+        expressions = rest.first
+    else:
+        expressions = expr
+    if scheme_listp(expressions):
+        for e in expressions:
+            defined_names(e, names)
+
+# Calls
+
+def compile_call(operator, operands, scope, tail):
+    operator = scheme_compile(operator, scope)
+    operands = [scheme_compile(operand, scope) for operand in operands]
+    finish = tail_call if tail else complete_call
+    # Calls with few operands build their argument list directly, which saves
+    # a Python frame for each nested call
+    if len(operands) == 0:
+        return lambda env: finish(operator(env), [], env)
+    elif len(operands) == 1:
+        a, = operands
+        return lambda env: finish(operator(env), [a(env)], env)
+    elif len(operands) == 2:
+        a, b = operands
+        return lambda env: finish(operator(env), [a(env), b(env)], env)
+    elif len(operands) == 3:
+        a, b, c = operands
+        return lambda env: finish(operator(env), [a(env), b(env), c(env)], env)
+    def call(env):
+        procedure = operator(env)
+        return finish(procedure, [operand(env) for operand in operands], env)
+    return call
+
+def tail_call(procedure, args, env):
+    """Return a TailCall of PROCEDURE on ARGS if it is user-defined, leaving
+    the call to be made by the caller; otherwise make the call."""
+    if isinstance(procedure, UserDefinedProcedure):
+        return TailCall(procedure, args, env)
+    return complete_call(procedure, args, env)
+
+def compile_sequence(expressions, scope, tail):
+    """Compile a Scheme list of EXPRESSIONS that are evaluated in order, with
+    the value of the last, like eval_all."""
+    if expressions is nil:
+        return lambda env: okay
+    codes = [scheme_compile(expr, scope) for expr in expressions]
+    codes[-1] = scheme_compile(expressions[len(codes) - 1], scope, tail)
+    if len(codes) == 1:
+        return codes[0]
+    init, last = codes[:-1], codes[-1]
+    def sequence(env):
+        for code in init:
+            code(env)
+        return last(env)
+    return sequence
+
+def complete_call(procedure, args, env):
+    """Return the value of calling PROCEDURE on a Python list of ARGS from
+    environment ENV, making any tail calls that it returns in turn."""
+    while True:
+        if isinstance(procedure, UserDefinedProcedure):
+            body = procedure.compiled or compile_body(procedure)
+            result = body[0](bind_arguments(procedure, body, args, env))
+            if type(result) is not TailCall:
+                return result
+            procedure, args, env = result.procedure, result.args, result.env
+        elif isinstance(procedure, PrimitiveProcedure):
+            if procedure.use_env:
+                args.append(env)
+            try:
+                return procedure.fn(*args)
+            except TypeError:
+                raise SchemeError
+        else:
+            raise SchemeError("cannot call: {0}".format(str(procedure)))
+
+def compile_body(procedure):
+    """Compile the body of PROCEDURE, which was not made by compiled code."""
+    procedure.compiled = compile_procedure(procedure.formals, procedure.body, ())
+    return procedure.compiled
+
+def compile_procedure(formals, body, scope):
+    """Return [code, names, arity] for a procedure with FORMALS and BODY made
+    in an environment described by SCOPE, where names are the names of its
+    call frames and arity is the number of its formal parameters."""
+    if not scheme_listp(formals):
+        # Calls make their frames with make_call_frame
+        return [compile_sequence(body, (), True), None, None]
+    names = list(formals)
+    for expr in body:
+        defined_names(expr, names)
+    scope = ((names, len(formals)),) + scope
+    return [compile_sequence(body, scope, True), names, len(formals)]
+
+def bind_arguments(procedure, body, args, env):
+    """Return a frame for a call of PROCEDURE, with compiled BODY, from ENV
+    that binds its formal parameters to ARGS, like make_call_frame."""
+    _, names, arity = body
+    if names is None:
+        scheme_args = nil
+        for arg in reversed(args):
+            scheme_args = Pair(arg, scheme_args)
+        return make_call_frame(procedure, scheme_args, env)
+    if len(args) != arity:
+        raise SchemeError('Invalid number of arguments')
+    if len(names) > arity:
+        args.extend([unassigned] * (len(names) - arity))
+    parent = procedure.env if isinstance(procedure, LambdaProcedure) else env
+    return LocalFrame(names, args, parent)
+
+# Special forms
+
+def compile_define(expressions, scope, tail):
+    check_form(expressions, 2)
+    target = expressions[0]
+    if scheme_symbolp(target):
+        check_form(expressions, 2, 2)
+        value = scheme_compile(expressions[1], scope)
+        store = compile_store(target, scope)
+        def define(env):
+            store(env, value(env))
+            return target
+        return define
+    elif isinstance(target, Pair) and scheme_symbolp(target.first):
+        name = target.first
+        make_procedure = compile_lambda(Pair(target.second, expressions.second),
+                                        scope, False)
+        store = compile_store(name, scope)
+        def define(env):
+            store(env, make_procedure(env))
+            return name
+        return define
+    else:
+        bad = target.first if isinstance(target, Pair) else target
+        raise SchemeError("Non-symbol: {}".format(bad))
+
+def compile_quote(expressions, scope, tail):
+    check_form(expressions, 1, 1)
+    value = expressions.first
+    return lambda env: value
+
+def compile_begin(expressions, scope, tail):
+    check_form(expressions, 1)
+    return compile_sequence(expressions, scope, tail)
+
+def compile_lambda(expressions, scope, tail):
+    check_form(expressions, 2)
+    formals = expressions.first
+    check_formals(formals)
+    body = expressions.second
+    compiled = compile_procedure(formals, body, scope)
+    def make_lambda(env):
+        procedure = LambdaProcedure(formals, body, env)
+        procedure.compiled = compiled
+        return procedure
+    return make_lambda
+
+def compile_mu(expressions, scope, tail):
+    check_form(expressions, 2)
+    formals = expressions[0]
+    check_formals(formals)
+    body = expressions.second
+    # The parent of a call frame is the frame of the caller, which is not
+    # known when the body is compiled
+    compiled = compile_procedure(formals, body, ())
+    def make_mu(env):
+        procedure = MuProcedure(formals, body)
+        procedure.compiled = compiled
+        return procedure
+    return make_mu
+
+def compile_if(expressions, scope, tail):
+    check_form(expressions, 2, 3)
+    test = scheme_compile(expressions[0], scope)
+    consequent = scheme_compile(expressions[1], scope, tail)
+    if len(expressions) == 2:
+        alternative = lambda env: okay
+    else:
+        alternative = scheme_compile(expressions[2], scope, tail)
+    def if_(env):
+        if test(env) is not False:
+            return consequent(env)
+        return alternative(env)
+    return if_
+
+def compile_and(expressions, scope, tail):
+    if len(expressions) == 0:
+        return lambda env: True
+    codes = [scheme_compile(expr, scope) for expr in expressions]
+    init = codes[:-1]
+    last = scheme_compile(expressions[len(codes) - 1], scope, tail)
+    def and_(env):
+        for code in init:
+            if code(env) is False:
+                return False
+        return last(env)
+    return and_
+
+def compile_or(expressions, scope, tail):
+    if len(expressions) == 0:
+        return lambda env: False
+    codes = [scheme_compile(expr, scope) for expr in expressions]
+    init = codes[:-1]
+    last = scheme_compile(expressions[len(codes) - 1], scope, tail)
+    def or_(env):
+        for code in init:
+            value = code(env)
+            if value is not False:
+                return value
+        return last(env)
+    return or_
+
+def compile_cond(expressions, scope, tail):
+    num_clauses = len(expressions)
+    clauses = []
+    for i, clause in enumerate(expressions):
+        # A malformed clause is only reported if it is reached
+        try:
+            clauses.append(compile_clause(clause, i == num_clauses - 1,
+                                          scope, tail))
+        except SchemeError as err:
+            clauses.append([compile_error(err), None])
+    def cond(env):
+        for test, body in clauses:
+            value = test(env)
+            if value is not False:
+                return value if body is None else body(env)
+        return okay
+    return cond
+
+def compile_clause(clause, last, scope, tail):
+    """Return [test, body] for a cond CLAUSE, where body is None if the clause
+    has the value of its test."""
+    check_form(clause, 1)
+    if clause.first == "else":
+        if not last:
+            raise SchemeError("else must be last")
+        if clause.second is nil:
+            raise SchemeError("badly formed else clause")
+        test = lambda env: True
+    else:
+        test = scheme_compile(clause.first, scope)
+    if len(clause.second) == 0:
+        return [test, None]
+    return [test, compile_sequence(clause.second, scope, tail)]
+
+def compile_let(expressions, scope, tail):
+    check_form(expressions, 2)
+    bindings = expressions.first
+    if not scheme_listp(bindings):
+        raise SchemeError("bad bindings list in let form")
+    names, values = [], []
+    for bind in bindings:
+        # A malformed binding is only reported once the ones before it are
+        # evaluated
+        try:
+            if len(bind) != 2:
+                raise SchemeError("bad definition")
+            check_formals(Pair(bind[0], nil))
+            if bind[0] not in names:
+                names.append(bind[0])
+            values.append([names.index(bind[0]), scheme_compile(bind[1], scope)])
+        except SchemeError as err:
+            values.append([None, compile_error(err)])
+    bound = len(names)
+    for expr in expressions.second:
+        defined_names(expr, names)
+    body = compile_sequence(expressions.second, ((names, bound),) + scope, tail)
+    def let(env):
+        let_values = [unassigned] * len(names)
+        for index, value in values:
+            let_values[index] = value(env)
+        return body(LocalFrame(names, let_values, env))
+    return let
+
+COMPILERS = {
+    "and": compile_and,
+    "begin": compile_begin,
+    "cond": compile_cond,
+    "define": compile_define,
+    "if": compile_if,
+    "lambda": compile_lambda,
+    "let": compile_let,
+    "mu": compile_mu,
+    "or": compile_or,
+    "quote": compile_quote,
+}
+
+def compiled_eval(expr, env, _=None): # Optional third argument is ignored
+    """Evaluate Scheme expression EXPR in environment ENV by compiling it.
+
+    >>> compiled_eval(read_line("((lambda (x) (* x x)) 5)"), create_global_frame())
+    25
+    """
+    return scheme_compile(expr)(env)
+
+def compiled_apply(procedure, args, env):
+    """Apply Scheme PROCEDURE to a Scheme list of argument values ARGS in
+    environment ENV, running compiled bodies."""
+    return complete_call(procedure, list(args), env)
+
+# The eval and apply of each evaluator, by name. The read-eval-print loop and
+# the eval and apply procedures of a new global frame use ENGINE.
+ENGINES = {
+    "tree": [scheme_optimized_eval, scheme_apply],
+    "compile": [compiled_eval, compiled_apply],
+}
+ENGINE = "compile"
+
 ################
 # Input/Output #
 ################
@@ -412,7 +969,7 @@ def read_eval_print_loop(next_line, env, interactive=False, quiet=False,
             src = next_line()
             while src.more_on_line:
                 expression = scheme_read(src)
-                result = scheme_eval(expression, env)
+                result = ENGINES[ENGINE][0](expression, env)
                 if not quiet and result is not None:
                     print(result)
         except (SchemeError, SyntaxError, ValueError, RuntimeError) as err:
@@ -473,22 +1030,31 @@ def scheme_open(filename):
 def create_global_frame():
     """Initialize and return a single-frame environment with built-in names."""
     env = Frame(None)
-    env.define("eval", PrimitiveProcedure(scheme_eval, True))
-    env.define("apply", PrimitiveProcedure(scheme_apply, True))
+    evaluate, apply = ENGINES[ENGINE]
+    env.define("eval", PrimitiveProcedure(evaluate, True))
+    env.define("apply", PrimitiveProcedure(apply, True))
     env.define("load", PrimitiveProcedure(scheme_load, True))
     add_primitives(env)
     return env
 
 @main
 def run(*argv):
+    global ENGINE
     import argparse
+    import sys
+    # Engines defined in other modules import this one as scheme
+    sys.modules.setdefault('scheme', sys.modules[__name__])
+    import scheme_vm, scheme_cek
     parser = argparse.ArgumentParser(description='CS 61A Scheme interpreter')
     parser.add_argument('-load', '-i', action='store_true',
                        help='run file interactively')
     parser.add_argument('file', nargs='?',
                         type=argparse.FileType('r'), default=None,
                         help='Scheme file to run')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default=ENGINE,
+                        help='evaluator to use (default: {})'.format(ENGINE))
     args = parser.parse_args()
+    ENGINE = args.engine
 
     next_line = buffer_input
     interactive = True
@@ -0,0 +1,85 @@
+"""Timing the Scheme evaluators on small programs.
+
+Usage: python3 scheme_benchmark.py [-e ENGINE ...] [-r REPEAT]
+
+Each program is a list of definitions followed by an expression to time. The
+time of each engine in scheme.ENGINES is reported, with its speedup over the
+tree-walking evaluator.
+"""
+
+import time
+
+import scheme
+import scheme_vm, scheme_cek
+from scheme import ENGINES, create_global_frame
+from scheme_reader import read_line
+from ucb import main
+
+BENCHMARKS = {
+    'fib': [
+        '(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))',
+        '(fib 18)'],
+    'loop': [
+        '(define (loop n total) (if (= n 0) total (loop (- n 1) (+ total n))))',
+        '(loop 20000 0)'],
+    'count': [
+        '(define (count n) (if (= n 0) 0 (+ 1 (count (- n 1)))))',
+        '(define (repeat k) (if (> k 0) (begin (count 200) (repeat (- k 1)))))',
+        '(repeat 100)'],
+    'lists': [
+        '(define (range a b) (if (>= a b) nil (cons a (range (+ a 1) b))))',
+        '(define (map f s) (if (null? s) nil (cons (f (car s)) (map f (cdr s)))))',
+        '(define (sum s) (if (null? s) 0 (+ (car s) (sum (cdr s)))))',
+        '(define (repeat k total) (if (= k 0) total '
+        '  (repeat (- k 1) (+ total (sum (map (lambda (x) (* x x)) (range 0 100)))))))',
+        '(repeat 100 0)'],
+    'closures': [
+        '(define (make-counter) (define n 0) (lambda (k) (let ((m (+ n k))) m)))',
+        '(define (compose f g) (lambda (x) (f (g x))))',
+        '(define (loop k f) (if (= k 0) (f 0) (loop (- k 1) (compose f (make-counter)))))',
+        '(define (repeat k) (if (> k 0) (begin (loop 100 (lambda (x) x)) (repeat (- k 1)))))',
+        '(repeat 100)'],
+}
+
+def time_program(engine, program, repeat=3):
+    """Return the least time in seconds taken by ENGINE to evaluate the last
+    expression of PROGRAM after its definitions, over REPEAT runs."""
+    saved, scheme.ENGINE = scheme.ENGINE, engine
+    evaluate = ENGINES[engine][0]
+    try:
+        env = create_global_frame()
+        for source in program[:-1]:
+            evaluate(read_line(source), env)
+        expr = read_line(program[-1])
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            evaluate(expr, env)
+            times.append(time.perf_counter() - start)
+        return min(times)
+    finally:
+        scheme.ENGINE = saved
+
+@main
+def run(*argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Time the Scheme evaluators')
+    parser.add_argument('-e', '--engines', nargs='+', default=sorted(ENGINES),
+                        choices=sorted(ENGINES), metavar='ENGINE',
+                        help='engines to time (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of each program, of which the fastest '
+                             'is reported (default: 3)')
+    args = parser.parse_args()
+
+    print('{:10}'.format('program') +
+          ''.join('{:>18}'.format(engine) for engine in args.engines))
+    for name, program in BENCHMARKS.items():
+        times = {engine: time_program(engine, program, args.repeat)
+                 for engine in args.engines}
+        if 'tree' in times:
+            base = times['tree']
+        else:
+            base = time_program('tree', program, args.repeat)
+        cells = ['{:>10.4f}s{:>6.1f}x'.format(t, base / t) for t in times.values()]
+        print('{:10}'.format(name) + ''.join(cells))
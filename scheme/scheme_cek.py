@@ -0,0 +1,242 @@
+"""An explicit-continuation evaluator for the Scheme interpreter.
+
+The evaluator is a CEK machine: its state is a Control (the expression being
+evaluated, or the value just found), an Environment, and a Continuation (what
+to do with that value). The continuation is a Python list of frames, each a
+tuple whose first element says which step of which form it resumes. Nothing
+is evaluated by a recursive Python call, so the depth of non-tail recursion
+in a Scheme program is limited only by memory. Tail calls push no frame.
+
+Expressions are evaluated from their Pair structure with the same checks, in
+the same order, as scheme_eval.
+
+Importing this module adds the engine "cek" to scheme.ENGINES.
+"""
+
+from scheme import *
+from scheme import ENGINES
+
+# Continuation frames, by their first element
+IF = 0        # (IF, operands, env): choose a branch of an if form
+SEQUENCE = 1  # (SEQUENCE, expressions, env): evaluate the rest of a body
+DEFINE = 2    # (DEFINE, symbol, env): bind the value to symbol
+AND = 3       # (AND, expressions, env): evaluate the rest of an and form
+OR = 4        # (OR, expressions, env): evaluate the rest of an or form
+COND = 5      # (COND, clauses, env): finish or move past the first clause
+LET = 6       # (LET, bindings, let_env, body, env): bind the first binding
+CALL = 7      # (CALL, operands, values, env): collect operator and operands
+
+def cek_eval(expr, env, _=None): # Optional third argument is ignored
+    """Evaluate Scheme expression EXPR in environment ENV with a CEK machine.
+
+    >>> env = create_global_frame()
+    >>> cek_eval(read_line("(define (count n) (if (= n 0) 0 (+ 1 (count (- n 1)))))"), env)
+    'count'
+    >>> cek_eval(read_line("(count 100000)"), env)
+    100000
+    """
+    return cek_run(expr, env, [])
+
+def cek_apply(procedure, args, env):
+    """Apply Scheme PROCEDURE to a Scheme list of argument values ARGS in
+    environment ENV with a CEK machine."""
+    stack = []
+    expr, env, value = apply_procedure(procedure, list(args), env, stack)
+    if expr is None:
+        return value
+    return cek_run(expr, env, stack)
+
+def cek_run(expr, env, stack):
+    """Evaluate EXPR in ENV and return the value that continuation STACK
+    makes of it."""
+    while True:
+        # Evaluate EXPR until it has a value, or begin a form, which pushes a
+        # frame to resume it and gives a subexpression to evaluate next
+        if isinstance(expr, Pair):
+            if not scheme_listp(expr):
+                raise SchemeError("malformed list: {0}".format(str(expr)))
+            elif scheme_symbolp(expr.first) and expr.first in SPECIAL_FORMS:
+                expr, env, value = begin_form(expr.first, expr.second, env,
+                                              stack)
+                if expr is not None:
+                    continue
+            else:
+                stack.append((CALL, expr.second, [], env))
+                expr = expr.first
+                continue
+        elif scheme_symbolp(expr):
+            value = env.lookup(expr)
+        elif self_evaluating(expr):
+            value = expr
+        else:
+            raise SchemeError("malformed list: {0}".format(str(expr)))
+
+        # Return VALUE to the frames of the continuation until one of them
+        # gives an expression to evaluate
+        expr = None
+        while expr is None:
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind, env = frame[0], frame[-1]
+            if kind == CALL:
+                _, operands, values, _ = frame
+                values.append(value)
+                if operands is not nil:
+                    stack.append((CALL, operands.second, values, env))
+                    expr = operands.first
+                else:
+                    expr, env, value = apply_procedure(values[0], values[1:],
+                                                       env, stack)
+            elif kind == IF:
+                operands = frame[1]
+                if value is not False:
+                    expr = operands[1]
+                elif operands.second.second is nil:
+                    value = okay
+                else:
+                    expr = operands[2]
+            elif kind == SEQUENCE:
+                expr, env, value = begin_sequence(frame[1], env, stack)
+            elif kind == DEFINE:
+                env.define(frame[1], value)
+                value = frame[1]
+            elif kind == AND:
+                if value is not False:
+                    expr, env, value = begin_junction(AND, frame[1], env, stack)
+            elif kind == OR:
+                if value is False:
+                    expr, env, value = begin_junction(OR, frame[1], env, stack)
+            elif kind == COND:
+                clauses = frame[1]
+                if value is False:
+                    expr, env, value = begin_clause(clauses.second, env, stack)
+                elif clauses.first.second is not nil:
+                    expr, env, value = begin_sequence(clauses.first.second,
+                                                      env, stack)
+            elif kind == LET:
+                _, bindings, let_env, body, _ = frame
+                let_env.define(bindings.first[0], value)
+                expr, env, value = begin_binding(bindings.second, let_env,
+                                                 body, env, stack)
+
+# Each of the following begins evaluating part of a form in ENV, pushing any
+# frames it needs to STACK, and returns [expr, env, value]: the next
+# expression to evaluate and its environment, or None and the value of the
+# form.
+
+def begin_form(form, rest, env, stack):
+    """Begin the special FORM with operands REST."""
+    if form == "if":
+        check_form(rest, 2, 3)
+        stack.append((IF, rest, env))
+        return [rest.first, env, None]
+    elif form == "define":
+        check_form(rest, 2)
+        target = rest.first
+        if scheme_symbolp(target):
+            check_form(rest, 2, 2)
+            stack.append((DEFINE, target, env))
+            return [rest.second.first, env, None]
+        elif isinstance(target, Pair) and scheme_symbolp(target.first):
+            procedure = do_lambda_form(Pair(target.second, rest.second), env)
+            env.define(target.first, procedure)
+            return [None, env, target.first]
+        bad = target.first if isinstance(target, Pair) else target
+        raise SchemeError("Non-symbol: {}".format(bad))
+    elif form == "begin":
+        check_form(rest, 1)
+        return begin_sequence(rest, env, stack)
+    elif form == "and":
+        return begin_junction(AND, rest, env, stack)
+    elif form == "or":
+        return begin_junction(OR, rest, env, stack)
+    elif form == "cond":
+        return begin_clause(rest, env, stack)
+    elif form == "let":
+        check_form(rest, 2)
+        if not scheme_listp(rest.first):
+            raise SchemeError("bad bindings list in let form")
+        let_env = env.make_child_frame(nil, nil)
+        return begin_binding(rest.first, let_env, rest.second, env, stack)
+    # quote, lambda and mu have values without evaluating anything
+    return [None, env, SPECIAL_FORMS[form](rest, env)]
+
+def begin_sequence(expressions, env, stack):
+    """Begin the Scheme list EXPRESSIONS, evaluated in order like eval_all.
+    The last expression is evaluated with no frame of its own."""
+    if expressions is nil:
+        return [None, env, okay]
+    if expressions.second is not nil:
+        stack.append((SEQUENCE, expressions.second, env))
+    return [expressions.first, env, None]
+
+def begin_junction(kind, expressions, env, stack):
+    """Begin the remaining operands EXPRESSIONS of an and or an or form
+    (KIND)."""
+    if expressions is nil:
+        return [None, env, kind == AND]
+    if expressions.second is not nil:
+        stack.append((kind, expressions.second, env))
+    return [expressions.first, env, None]
+
+def begin_clause(clauses, env, stack):
+    """Begin the first of the cond CLAUSES."""
+    if clauses is nil:
+        return [None, env, okay]
+    clause = clauses.first
+    check_form(clause, 1)
+    if clause.first == "else":
+        if clauses.second is not nil:
+            raise SchemeError("else must be last")
+        if clause.second is nil:
+            raise SchemeError("badly formed else clause")
+        return begin_sequence(clause.second, env, stack)
+    stack.append((COND, clauses, env))
+    return [clause.first, env, None]
+
+def begin_binding(bindings, let_env, body, env, stack):
+    """Begin the first of the let BINDINGS, whose value is found in ENV and
+    defined in LET_ENV, or the let BODY in LET_ENV if none are left."""
+    if bindings is nil:
+        return begin_sequence(body, let_env, stack)
+    bind = bindings.first
+    if len(bind) != 2:
+        raise SchemeError("bad definition")
+    check_formals(Pair(bind[0], nil))
+    stack.append((LET, bindings, let_env, body, env))
+    return [bind[1], env, None]
+
+def apply_procedure(procedure, args, env, stack):
+    """Begin applying PROCEDURE to a Python list of ARGS."""
+    if isinstance(procedure, PrimitiveProcedure):
+        if procedure.use_env:
+            args.append(env)
+        try:
+            return [None, env, procedure.fn(*args)]
+        except TypeError:
+            raise SchemeError
+    elif isinstance(procedure, UserDefinedProcedure):
+        frame = bind_formals(procedure, args, env)
+        return begin_sequence(procedure.body, frame, stack)
+    raise SchemeError("cannot call: {0}".format(str(procedure)))
+
+def bind_formals(procedure, args, env):
+    """Return a frame for a call of PROCEDURE from ENV that binds its formal
+    parameters to ARGS, like make_call_frame. The frame is a LocalFrame,
+    which takes less memory than a Frame when many calls are pending."""
+    formals, names = procedure.formals, []
+    while isinstance(formals, Pair):
+        names.append(formals.first)
+        formals = formals.second
+    if formals is not nil:
+        scheme_args = nil
+        for arg in reversed(args):
+            scheme_args = Pair(arg, scheme_args)
+        return make_call_frame(procedure, scheme_args, env)
+    if len(names) != len(args):
+        raise SchemeError('Invalid number of arguments')
+    parent = procedure.env if isinstance(procedure, LambdaProcedure) else env
+    return LocalFrame(names, args, parent)
+
+ENGINES["cek"] = [cek_eval, cek_apply]
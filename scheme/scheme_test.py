@@ -1,6 +1,6 @@
 """Unit testing framework for the Scheme interpreter.
 
-Usage: python3 scheme_test.py FILE
+Usage: python3 scheme_test.py FILE [ENGINE]
 
 Interprets FILE as interactive Scheme source code, and compares each line
 of printed output from the read-eval-print loop and from any output functions
@@ -14,6 +14,7 @@ Differences between printed and expected outputs are printed with line numbers.
 
 import io
 import sys
+import scheme
 from buffer import Buffer
 from scheme import read_eval_print_loop, create_global_frame
 from scheme_tokens import tokenize_lines
@@ -68,8 +69,12 @@ class TestReader:
         raise EOFError
 
 @main
-def run_tests(src_file='tests.scm'):
-    """Run a read-eval loop that reads from src_file and collects outputs."""
+def run_tests(src_file='tests.scm', engine=None):
+    """Run a read-eval loop that reads from src_file and collects outputs,
+    evaluating with ENGINE (default: scheme.ENGINE)."""
+    if engine is not None:
+        import scheme_vm, scheme_cek
+        scheme.ENGINE = engine
     sys.stderr = sys.stdout = io.StringIO() # Collect output to stdout and stderr
     reader = None
     try:
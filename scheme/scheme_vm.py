@@ -0,0 +1,490 @@
+"""A bytecode virtual machine for the Scheme interpreter.
+
+Each expression is compiled to bytecode: an array of 32-bit words, each an
+opcode or one of its operands, together with a list of the constants that
+operands refer to. A single loop runs the bytecode with a stack of values
+and keeps its own stack of callers, so calls do not grow the Python stack.
+
+Variables are resolved as in the compiler of scheme.py: parameters of the
+innermost frame are loaded by index, and other names through the functions
+that compile_symbol returns.
+
+Importing this module adds the engine "vm" to scheme.ENGINES.
+"""
+
+from array import array
+
+from scheme import *
+from scheme import ENGINES
+
+###########
+# Opcodes #
+###########
+
+OPCODES = [
+    'CONST',          # k: push constant k
+    'LOCAL',          # i: push value i of the current frame
+    'REF',            # k: push the value found by function k of the frame
+    'DEFINE',         # k: define symbol k to be the top value, replaced by k
+    'DEFINE_LOCAL',   # i k: set value i of the frame, replacing it by k
+    'POP',            # pop the top value
+    'JUMP',           # a: continue at address a
+    'JUMP_IF_FALSE',  # a: pop the top value and jump to a if it is false
+    'FALSE_OR_POP',   # a: jump to a if the top value is false, else pop it
+    'TRUE_OR_POP',    # a: jump to a unless the top value is false, else pop
+    'CALL',           # n: call a procedure on the n values above it
+    'TAIL_CALL',      # n: call, then return to the caller of this procedure
+    'RETURN',         # return the top value to the caller
+    'LAMBDA',         # k: push a lambda procedure made from constant k
+    'MU',             # k: push a mu procedure made from constant k
+    'LET',            # k: bind values in a new frame, as given by constant k
+    'END_LET',        # return to the parent of the current frame
+    'ERROR',          # k: raise constant k
+]
+(CONST, LOCAL, REF, DEFINE, DEFINE_LOCAL, POP, JUMP, JUMP_IF_FALSE,
+ FALSE_OR_POP, TRUE_OR_POP, CALL, TAIL_CALL, RETURN, LAMBDA, MU, LET,
+ END_LET, ERROR) = range(len(OPCODES))
+
+# Number of operands of each opcode
+OPERANDS = {DEFINE_LOCAL: 2, POP: 0, RETURN: 0, END_LET: 0}
+
+# Calls that are not tail calls may nest this deeply
+MAX_DEPTH = 100000
+
+class Code:
+    """Bytecode OPS and the CONSTANTS its operands refer to. OPS is a list
+    while the code is compiled and an array once it is finished. INDEXES maps
+    the id of each constant to its index while the code is compiled."""
+    __slots__ = ('ops', 'constants', 'indexes')
+
+    def __init__(self):
+        self.ops = []
+        self.constants = []
+        self.indexes = {}
+
+def emit(code, *words):
+    """Append the opcode and operands in WORDS to CODE and return the address
+    that follows them."""
+    code.ops.extend(words)
+    return len(code.ops)
+
+def constant(code, value):
+    """Return the index of VALUE among the constants of CODE, adding it unless
+    that very object is already one of them. The constants keep every value
+    alive, so the id of a value is not reused while the code is compiled."""
+    index = code.indexes.get(id(value))
+    if index is None:
+        index = code.indexes[id(value)] = len(code.constants)
+        code.constants.append(value)
+    return index
+
+def patch(code, address):
+    """Make the jump whose operand is at ADDRESS jump to the end of CODE."""
+    code.ops[address] = len(code.ops)
+
+def items(expressions):
+    """Return a Python list of the elements of the Scheme list EXPRESSIONS.
+    Unlike list(EXPRESSIONS), which indexes each element from the start of the
+    list, this takes time proportional to its length."""
+    elements = []
+    while isinstance(expressions, Pair):
+        elements.append(expressions.first)
+        expressions = expressions.second
+    return elements
+
+def finish(code):
+    """Return CODE with a final RETURN and its words in an array.
+
+    >>> operands = nil
+    >>> for i in range(70000):
+    ...     operands = Pair(1000 + i, operands)
+    >>> code = vm_compile(Pair('if', Pair(False, Pair(0, Pair(Pair('+', operands), nil)))))
+    >>> len(code.ops) > 140000, len(code.constants)
+    (True, 70003)
+    >>> vm_run(code, create_global_frame())
+    2519965000
+    """
+    code.ops.append(RETURN)
+    code.ops = array('I', code.ops)
+    code.indexes = None
+    return code
+
+def disassemble(code):
+    """Return the instructions of CODE as lines of text.
+
+    >>> for line in disassemble(vm_compile(read_line("(if (f) 1 (g 2))"))):
+    ...     print(line)
+    0 REF 0
+    2 CALL 0
+    4 JUMP_IF_FALSE 10
+    6 CONST 1
+    8 JUMP 16
+    10 REF 2
+    12 CONST 3
+    14 CALL 1
+    16 RETURN
+    """
+    lines, pc = [], 0
+    while pc < len(code.ops):
+        op = code.ops[pc]
+        n = OPERANDS.get(op, 1)
+        operands = code.ops[pc + 1:pc + 1 + n]
+        lines.append(' '.join([str(pc), OPCODES[op]] + [str(w) for w in operands]))
+        pc += 1 + n
+    return lines
+
+###############
+# Compilation #
+###############
+
+def vm_compile(expr, scope=()):
+    """Return the bytecode of Scheme expression EXPR, for an environment whose
+    LocalFrames are described by SCOPE."""
+    code = Code()
+    emit_expression(expr, scope, False, code)
+    return finish(code)
+
+def emit_expression(expr, scope, tail, code):
+    """Emit to CODE the instructions that push the value of EXPR. If TAIL,
+    they may instead make a tail call. Errors in the form of EXPR are raised
+    when the instructions are run."""
+    start = len(code.ops)
+    try:
+        emit_form(expr, scope, tail, code)
+    except SchemeError as err:
+        del code.ops[start:]
+        emit(code, ERROR, constant(code, err))
+
+def emit_form(expr, scope, tail, code):
+    # Atoms
+    assert expr is not None
+    if scheme_symbolp(expr):
+        return emit_symbol(expr, scope, code)
+    elif self_evaluating(expr):
+        return emit(code, CONST, constant(code, expr))
+
+    # Combinations
+    if not scheme_listp(expr):
+        raise SchemeError("malformed list: {0}".format(str(expr)))
+    first, rest = expr.first, expr.second
+    if scheme_symbolp(first) and first in EMITTERS:
+        return EMITTERS[first](rest, scope, tail, code)
+    emit_expression(first, scope, False, code)
+    operands = items(rest)
+    for operand in operands:
+        emit_expression(operand, scope, False, code)
+    emit(code, TAIL_CALL if tail else CALL, len(operands))
+
+def emit_symbol(symbol, scope, code):
+    if scope and symbol in scope[0][0]:
+        names, bound = scope[0]
+        if names.index(symbol) < bound:
+            return emit(code, LOCAL, names.index(symbol))
+    emit(code, REF, constant(code, compile_symbol(symbol, scope)))
+
+def emit_sequence(expressions, scope, tail, code):
+    """Emit a Scheme list of EXPRESSIONS that are evaluated in order, with the
+    value of the last, like eval_all."""
+    if expressions is nil:
+        return emit(code, CONST, constant(code, okay))
+    while expressions.second is not nil:
+        emit_expression(expressions.first, scope, False, code)
+        emit(code, POP)
+        expressions = expressions.second
+    emit_expression(expressions.first, scope, tail, code)
+
+def vm_procedure(formals, body, scope):
+    """Return [code, names, arity] for a procedure with FORMALS and BODY made
+    in an environment described by SCOPE, as compile_procedure does."""
+    code = Code()
+    if not scheme_listp(formals):
+        emit_sequence(body, (), True, code)
+        return [finish(code), None, None]
+    names = items(formals)
+    arity = len(names)
+    for expr in items(body):
+        defined_names(expr, names)
+    emit_sequence(body, ((names, arity),) + scope, True, code)
+    return [finish(code), names, arity]
+
+def vm_body(procedure):
+    """Compile the body of PROCEDURE, which was not made by bytecode."""
+    procedure.bytecode = vm_procedure(procedure.formals, procedure.body, ())
+    return procedure.bytecode
+
+# Special forms
+
+def emit_define(expressions, scope, tail, code):
+    check_form(expressions, 2)
+    target = expressions[0]
+    if scheme_symbolp(target):
+        check_form(expressions, 2, 2)
+        emit_expression(expressions[1], scope, False, code)
+    elif isinstance(target, Pair) and scheme_symbolp(target.first):
+        emit_lambda(Pair(target.second, expressions.second), scope, False, code)
+        target = target.first
+    else:
+        bad = target.first if isinstance(target, Pair) else target
+        raise SchemeError("Non-symbol: {}".format(bad))
+    if scope and target in scope[0][0]:
+        emit(code, DEFINE_LOCAL, scope[0][0].index(target), constant(code, target))
+    else:
+        emit(code, DEFINE, constant(code, target))
+
+def emit_quote(expressions, scope, tail, code):
+    check_form(expressions, 1, 1)
+    emit(code, CONST, constant(code, expressions.first))
+
+def emit_begin(expressions, scope, tail, code):
+    check_form(expressions, 1)
+    emit_sequence(expressions, scope, tail, code)
+
+def emit_lambda(expressions, scope, tail, code):
+    check_form(expressions, 2)
+    formals = expressions.first
+    check_formals(formals)
+    body = expressions.second
+    procedure = [formals, body, vm_procedure(formals, body, scope)]
+    emit(code, LAMBDA, constant(code, procedure))
+
+def emit_mu(expressions, scope, tail, code):
+    check_form(expressions, 2)
+    formals = expressions[0]
+    check_formals(formals)
+    body = expressions.second
+    procedure = [formals, body, vm_procedure(formals, body, ())]
+    emit(code, MU, constant(code, procedure))
+
+def emit_if(expressions, scope, tail, code):
+    check_form(expressions, 2, 3)
+    emit_expression(expressions[0], scope, False, code)
+    to_alternative = emit(code, JUMP_IF_FALSE, 0) - 1
+    emit_expression(expressions[1], scope, tail, code)
+    to_end = emit(code, JUMP, 0) - 1
+    patch(code, to_alternative)
+    if len(expressions) == 2:
+        emit(code, CONST, constant(code, okay))
+    else:
+        emit_expression(expressions[2], scope, tail, code)
+    patch(code, to_end)
+
+def emit_and(expressions, scope, tail, code):
+    emit_junction(expressions, scope, tail, code, True, FALSE_OR_POP)
+
+def emit_or(expressions, scope, tail, code):
+    emit_junction(expressions, scope, tail, code, False, TRUE_OR_POP)
+
+def emit_junction(expressions, scope, tail, code, empty, jump):
+    """Emit an and or an or form, which has the value EMPTY when it has no
+    operands and stops early with a JUMP instruction."""
+    if expressions is nil:
+        return emit(code, CONST, constant(code, empty))
+    to_end = []
+    while expressions.second is not nil:
+        emit_expression(expressions.first, scope, False, code)
+        to_end.append(emit(code, jump, 0) - 1)
+        expressions = expressions.second
+    emit_expression(expressions.first, scope, tail, code)
+    for address in to_end:
+        patch(code, address)
+
+def emit_cond(expressions, scope, tail, code):
+    clauses = items(expressions)
+    to_end = []
+    for i, clause in enumerate(clauses):
+        # A malformed clause is only reported if it is reached
+        start = len(code.ops)
+        try:
+            emit_clause(clause, i == len(clauses) - 1, scope, tail, code, to_end)
+        except SchemeError as err:
+            del code.ops[start:]
+            emit(code, ERROR, constant(code, err))
+    emit(code, CONST, constant(code, okay))
+    for address in to_end:
+        patch(code, address)
+
+def emit_clause(clause, last, scope, tail, code, to_end):
+    """Emit a cond CLAUSE that jumps to the end of the cond form when it
+    applies, adding the address of its jump to TO_END."""
+    check_form(clause, 1)
+    if clause.first == "else":
+        if not last:
+            raise SchemeError("else must be last")
+        if clause.second is nil:
+            raise SchemeError("badly formed else clause")
+        emit_sequence(clause.second, scope, tail, code)
+        to_end.append(emit(code, JUMP, 0) - 1)
+        return
+    emit_expression(clause.first, scope, False, code)
+    if clause.second is nil:
+        to_end.append(emit(code, TRUE_OR_POP, 0) - 1)
+        return
+    to_next = emit(code, JUMP_IF_FALSE, 0) - 1
+    emit_sequence(clause.second, scope, tail, code)
+    to_end.append(emit(code, JUMP, 0) - 1)
+    patch(code, to_next)
+
+def emit_let(expressions, scope, tail, code):
+    check_form(expressions, 2)
+    bindings = expressions.first
+    if not scheme_listp(bindings):
+        raise SchemeError("bad bindings list in let form")
+    names, indices = [], []
+    for bind in items(bindings):
+        # A malformed binding is only reported once the ones before it are
+        # evaluated
+        start = len(code.ops)
+        try:
+            if len(bind) != 2:
+                raise SchemeError("bad definition")
+            check_formals(Pair(bind[0], nil))
+            if bind[0] not in names:
+                names.append(bind[0])
+            indices.append(names.index(bind[0]))
+            emit_expression(bind[1], scope, False, code)
+        except SchemeError as err:
+            del code.ops[start:]
+            emit(code, ERROR, constant(code, err))
+    bound = len(names)
+    for expr in items(expressions.second):
+        defined_names(expr, names)
+    emit(code, LET, constant(code, [names, indices]))
+    emit_sequence(expressions.second, ((names, bound),) + scope, tail, code)
+    emit(code, END_LET)
+
+EMITTERS = {
+    "and": emit_and,
+    "begin": emit_begin,
+    "cond": emit_cond,
+    "define": emit_define,
+    "if": emit_if,
+    "lambda": emit_lambda,
+    "let": emit_let,
+    "mu": emit_mu,
+    "or": emit_or,
+    "quote": emit_quote,
+}
+
+###########
+# Running #
+###########
+
+def vm_run(code, env):
+    """Run bytecode CODE in environment ENV and return its value."""
+    ops, constants, pc = code.ops, code.constants, 0
+    stack = []
+    callers = [] # [ops, constants, pc, env] to return to for each call
+    while True:
+        op = ops[pc]
+        if op == LOCAL:
+            stack.append(env.values[ops[pc + 1]])
+            pc += 2
+        elif op == REF:
+            stack.append(constants[ops[pc + 1]](env))
+            pc += 2
+        elif op == CONST:
+            stack.append(constants[ops[pc + 1]])
+            pc += 2
+        elif op == CALL or op == TAIL_CALL:
+            n = ops[pc + 1]
+            start = len(stack) - n
+            args = stack[start:]
+            del stack[start:]
+            procedure = stack.pop()
+            if isinstance(procedure, UserDefinedProcedure):
+                body = procedure.bytecode or vm_body(procedure)
+                frame = bind_arguments(procedure, body, args, env)
+                if op == CALL:
+                    if len(callers) >= MAX_DEPTH:
+                        raise RecursionError("maximum recursion depth exceeded")
+                    callers.append([ops, constants, pc + 2, env])
+                ops, constants, pc, env = body[0].ops, body[0].constants, 0, frame
+                continue
+            elif isinstance(procedure, PrimitiveProcedure):
+                if procedure.use_env:
+                    args.append(env)
+                try:
+                    stack.append(procedure.fn(*args))
+                except TypeError:
+                    raise SchemeError
+            else:
+                raise SchemeError("cannot call: {0}".format(str(procedure)))
+            if op == CALL:
+                pc += 2
+            elif not callers:
+                return stack.pop()
+            else:
+                ops, constants, pc, env = callers.pop()
+        elif op == RETURN:
+            if not callers:
+                return stack.pop()
+            ops, constants, pc, env = callers.pop()
+        elif op == JUMP_IF_FALSE:
+            if stack.pop() is False:
+                pc = ops[pc + 1]
+            else:
+                pc += 2
+        elif op == JUMP:
+            pc = ops[pc + 1]
+        elif op == POP:
+            stack.pop()
+            pc += 1
+        elif op == FALSE_OR_POP or op == TRUE_OR_POP:
+            if (stack[-1] is False) == (op == FALSE_OR_POP):
+                pc = ops[pc + 1]
+            else:
+                stack.pop()
+                pc += 2
+        elif op == DEFINE:
+            symbol = constants[ops[pc + 1]]
+            env.define(symbol, stack[-1])
+            stack[-1] = symbol
+            pc += 2
+        elif op == DEFINE_LOCAL:
+            env.values[ops[pc + 1]] = stack[-1]
+            stack[-1] = constants[ops[pc + 2]]
+            pc += 3
+        elif op == LAMBDA or op == MU:
+            formals, body, compiled = constants[ops[pc + 1]]
+            if op == LAMBDA:
+                procedure = LambdaProcedure(formals, body, env)
+            else:
+                procedure = MuProcedure(formals, body)
+            procedure.bytecode = compiled
+            stack.append(procedure)
+            pc += 2
+        elif op == LET:
+            names, indices = constants[ops[pc + 1]]
+            start = len(stack) - len(indices)
+            values = [unassigned] * len(names)
+            for index, value in zip(indices, stack[start:]):
+                values[index] = value
+            del stack[start:]
+            env = LocalFrame(names, values, env)
+            pc += 2
+        elif op == END_LET:
+            env = env.parent
+            pc += 1
+        elif op == ERROR:
+            raise constants[ops[pc + 1]]
+
+def vm_eval(expr, env, _=None): # Optional third argument is ignored
+    """Evaluate Scheme expression EXPR in environment ENV with the virtual
+    machine.
+
+    >>> vm_eval(read_line("((lambda (x) (* x x)) 5)"), create_global_frame())
+    25
+    """
+    return vm_run(vm_compile(expr), env)
+
+def vm_apply(procedure, args, env):
+    """Apply Scheme PROCEDURE to a Scheme list of argument values ARGS in
+    environment ENV with the virtual machine."""
+    code = Code()
+    values = items(Pair(procedure, args))
+    for value in values:
+        emit(code, CONST, constant(code, value))
+    emit(code, CALL, len(values) - 1)
+    return vm_run(finish(code), env)
+
+ENGINES["vm"] = [vm_eval, vm_apply]